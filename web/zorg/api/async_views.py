@@ -0,0 +1,220 @@
+"""ASGI versions of the search and typeahead endpoints.
+
+Django 2.2 has no async views, so these are plain ASGI handlers that
+:mod:`zorg.asgi` routes to; everything else goes to the WSGI application.
+Their Elastic requests share one pooled aiohttp session per process. At most
+ELASTIC_ASYNC_MAX_CONCURRENCY requests are in flight, a search that can't get
+a slot within ELASTIC_ASYNC_TIMEOUT seconds is answered with 503 instead of
+queueing up.
+
+Requests, responses and caching are the same as those of :mod:`api.views`.
+Only the in-process cache tier is read on the event loop, the shared tier
+(Redis) is reached through the default executor.
+"""
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import re
+
+import aiohttp
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.http import QueryDict
+
+# Project
+from api import typeahead as typeahead_engine
+from api.cache import normalize_query, search_cache, typeahead_cache
+from api.views import search_params
+from datasets.normalized import elastic, postgis
+
+_logger = logging.getLogger(__name__)
+
+ROUTES = (
+    (re.compile(r'^/zorg/zoek/(activiteit|locatie|organisatie)/$'), 'search'),
+    (re.compile(r'^/zorg/zoek/$'), 'search'),
+    (re.compile(r'^/zorg/typeahead/$'), 'typeahead'),
+)
+
+
+def route(path):
+    """Handler and arguments for `path`, or None when it's not ours."""
+    for pattern, name in ROUTES:
+        match = pattern.match(path)
+        if match:
+            return globals()[name], match.groups()
+    return None
+
+
+class ElasticClient:
+    """Pooled async client for the Elastic search API."""
+
+    def __init__(self):
+        self._session = None
+        self._semaphore = None
+        self._hosts = itertools.cycle(settings.ELASTIC_SEARCH_HOSTS)
+
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=settings.ELASTIC_ASYNC_POOL_SIZE),
+                timeout=aiohttp.ClientTimeout(
+                    total=settings.ELASTIC_ASYNC_TIMEOUT),
+                headers={'Content-Type': 'application/json'})
+            self._semaphore = asyncio.Semaphore(
+                settings.ELASTIC_ASYNC_MAX_CONCURRENCY)
+        return self._session
+
+    async def search(self, body, filter_path):
+        """Raw JSON response of a search on ELASTIC_INDEX.
+
+        :raises asyncio.TimeoutError: when no slot frees up in time.
+        :raises elastic.CircuitOpen: when Elastic failed too often lately.
+        :raises elastic.SearchError: when Elastic fails or times out.
+        """
+        session = self.session()
+        elastic.breaker.check()
+        await asyncio.wait_for(
+            self._semaphore.acquire(), settings.ELASTIC_ASYNC_TIMEOUT)
+        try:
+            url = f'http://{next(self._hosts)}/{settings.ELASTIC_INDEX}/_search'
+            async with session.post(
+                    url, data=json.dumps(body),
+                    params={'filter_path': ','.join(filter_path)},
+                    timeout=aiohttp.ClientTimeout(
+                        total=settings.ELASTIC_SEARCH_TIMEOUT)) as response:
+                text = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            elastic.breaker.record(False)
+            raise elastic.SearchError() from e
+        finally:
+            self._semaphore.release()
+        elastic.breaker.record(response.status not in elastic.OVERLOADED)
+        if response.status != 200:
+            raise elastic.SearchError(
+                f'Elastic answered {response.status}: {text[:200]}')
+        return text
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+client = ElasticClient()
+
+
+def _in_thread(function, *args, **kwargs):
+    # Executor threads outlive requests, so close their connections the way
+    # the request signals do for a view
+    close_old_connections()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def _run(function, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(_in_thread, function, *args, **kwargs))
+
+
+async def _get_or_compute(response_cache, params, compute, labels=()):
+    """Async counterpart of `ResponseCache.get_or_compute`."""
+    key = await _run(response_cache.key, params)
+    value = response_cache.local.get(key)
+    if value is not None:
+        tier = 'local'
+    else:
+        value = await _run(cache.get, key)
+        if value is not None:
+            tier = 'shared'
+        else:
+            tier = 'miss'
+            value = await compute()
+            await _run(cache.set, key, value, timeout=response_cache.ttl)
+        response_cache.local.set(key, value)
+    await _run(
+        response_cache.count, tier, *(f'{label}:{tier}' for label in labels))
+    return value, tier
+
+
+async def search(scope, doctype=None):
+    """Perform a search"""
+    try:
+        # In a thread, the tag registry may have to be loaded
+        params = await _run(search_params, _query(scope), doctype)
+    except ValueError as e:
+        return 400, str(e), None
+
+    async def compute():
+        return elastic.with_hits(
+            await client.search(*elastic.search_request(**params)))
+
+    try:
+        body, tier = await _get_or_compute(
+            search_cache, ['search', params], compute,
+            labels=['geo'] if params['lonlat'] else [])
+    except elastic.CircuitOpen:
+        if not settings.SEARCH_FALLBACK:
+            raise
+        return 200, await _run(postgis.search, **params), 'fallback'
+    return 200, body, tier
+
+
+async def typeahead(scope):
+    """Perform a search"""
+    q = normalize_query(_query(scope).get('query'))
+    if settings.TYPEAHEAD_ENGINE == 'memory':
+        # In a thread, as the first call or a new generation builds the index
+        return 200, await _run(typeahead_engine.typeahead, q), 'memory'
+
+    async def compute():
+        results = await client.search(
+            elastic.typeahead_query(q), elastic.TYPEAHEAD_FILTER_PATH)
+        return elastic.typeahead_suggestions(json.loads(results))
+
+    body, tier = await _get_or_compute(
+        typeahead_cache, ['typeahead', q], compute)
+    return 200, body, tier
+
+
+def _query(scope):
+    return QueryDict(scope['query_string'])
+
+
+async def handle(scope, receive, send, handler, args):
+    """Answer the HTTP request in `scope` with `handler`."""
+    if scope['method'] not in ('GET', 'HEAD'):
+        status, body, tier = 405, '', None
+    else:
+        try:
+            status, body, tier = await handler(scope, *args)
+        except asyncio.TimeoutError:
+            _logger.warning('Too many searches in flight')
+            status, body, tier = 503, '', None
+        except elastic.CircuitOpen:
+            status, body, tier = 503, '', None
+        except elastic.SearchError:
+            _logger.critical('Exception while searching', exc_info=True)
+            status, body, tier = 500, '', None
+        except Exception:
+            _logger.fatal('Unexpected exception while searching', exc_info=True)
+            status, body, tier = 500, '', None
+
+    content = body.encode()
+    headers = [
+        (b'content-type', b'application/json' if status == 200 else b'text/plain'),
+        (b'content-length', str(len(content)).encode()),
+    ]
+    if tier:
+        headers.append((b'x-cache', tier.encode()))
+    if status == 405:
+        headers.append((b'allow', b'GET, HEAD'))
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': headers})
+    await send({'type': 'http.response.body',
+                'body': b'' if scope['method'] == 'HEAD' else content})
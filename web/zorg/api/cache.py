@@ -0,0 +1,147 @@
+"""Response cache for the search and typeahead endpoints.
+
+Two tiers: a small LRU per process, in front of the shared Django cache
+(Redis). Keys contain the normalized request parameters and the index
+generation, so a reload or sync of the index makes all cached responses
+unreachable at once; they then age out by TTL or LRU eviction.
+"""
+import collections
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Project
+from datasets.normalized import versions
+
+
+class LRUCache:
+    """Thread safe LRU cache with a time to live per entry."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return None
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (ttl or self.ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ResponseCache:
+    """Cached responses of one endpoint."""
+
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self.local = LRUCache(settings.SEARCH_CACHE_LOCAL_SIZE, ttl)
+        self.stats = collections.Counter()
+        self._stats_flushed = time.monotonic()
+        self._stats_lock = threading.Lock()
+        self._generation = (0, 0)  # (generation, checked at)
+
+    def generation(self):
+        """Index generation, looked up at most once per
+        SEARCH_CACHE_GENERATION_CHECK seconds."""
+        generation, checked = self._generation
+        now = time.monotonic()
+        if now - checked > settings.SEARCH_CACHE_GENERATION_CHECK:
+            generation = versions.index_generation()
+            self._generation = (generation, now)
+        return generation
+
+    def key(self, params):
+        digest = hashlib.sha1(
+            json.dumps(params, sort_keys=True).encode()).hexdigest()
+        return f'zorg:{self.name}:{self.generation()}:{digest}'
+
+    def get_or_compute(self, params, compute, labels=()):
+        """Return (response, tier), tier being 'local', 'shared' or 'miss'.
+
+        The tier is counted for the hit ratio, per label too.
+        """
+        key = self.key(params)
+        value = self.local.get(key)
+        if value is not None:
+            tier = 'local'
+        else:
+            value = cache.get(key)
+            if value is not None:
+                tier = 'shared'
+            else:
+                tier = 'miss'
+                value = compute()
+                cache.set(key, value, timeout=self.ttl)
+            self.local.set(key, value)
+        self.count(tier, *(f'{label}:{tier}' for label in labels))
+        return value, tier
+
+    def _stats_key(self, name):
+        return f'zorg:stats:{self.name}:{name}'
+
+    def count(self, *names):
+        """Count locally, add to the shared counters every
+        SEARCH_CACHE_STATS_FLUSH seconds."""
+        with self._stats_lock:
+            self.stats.update(names)
+            now = time.monotonic()
+            if now - self._stats_flushed < settings.SEARCH_CACHE_STATS_FLUSH:
+                return
+            stats, self.stats = self.stats, collections.Counter()
+            self._stats_flushed = now
+        for name, count in stats.items():
+            key = self._stats_key(name)
+            cache.add(key, 0, timeout=None)
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                cache.set(key, count, timeout=None)
+
+    def hit_ratios(self, labels=()):
+        """Shared hit counts and ratio, overall and per label."""
+        ratios = {}
+        for label in ('',) + tuple(labels):
+            names = {
+                tier: f'{label}:{tier}' if label else tier
+                for tier in ('local', 'shared', 'miss')}
+            counts = cache.get_many(
+                [self._stats_key(name) for name in names.values()])
+            tiers = {
+                tier: counts.get(self._stats_key(name), 0)
+                for tier, name in names.items()}
+            total = sum(tiers.values())
+            tiers['ratio'] = total and (tiers['local'] + tiers['shared']) / total
+            ratios[label or 'all'] = tiers
+        return ratios
+
+
+search_cache = ResponseCache('search', settings.SEARCH_CACHE_TTL)
+typeahead_cache = ResponseCache('typeahead', settings.TYPEAHEAD_CACHE_TTL)
+
+
+def normalize_query(q):
+    """Case and whitespace insensitive query text."""
+    return ' '.join((q or '').lower().split())
@@ -1,39 +1,209 @@
 # Python
 import logging
+import re
 import time
 import elasticsearch_dsl as es
 from django.conf import settings
 # Packages
 from django.core.management import BaseCommand
-from elasticsearch_dsl.connections import connections
+from elasticsearch.helpers import parallel_bulk
 
 # Project
+from datasets.normalized import documents, elastic, models, terms, versions
 from datasets.normalized.documents import Activiteit, Locatie, Organisatie, Term
 
 log = logging.getLogger(__name__)
 
 
+def _batches(queryset, size):
+    """Walk a queryset in primary key order, one batch of `size` rows at a time.
+
+    ``QuerySet.iterator()`` ignores ``prefetch_related`` on this Django
+    version, so we page on the primary key (keyset, no OFFSET) and let every
+    batch do its own prefetch. Memory stays bounded by the batch size.
+    """
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        batch = queryset if last is None else queryset.filter(pk__gt=last)
+        batch = list(batch[:size])
+        if not batch:
+            return
+        yield from batch
+        last = batch[-1].pk
+
+
 class Command(BaseCommand):
+    """Maintain the search index.
+
+    ``settings.ELASTIC_INDEX`` is an alias. Every ``--build`` creates a new
+    physical index ``<alias>_<timestamp>``, bulk loads it with refreshes and
+    replicas switched off, and then swaps the alias over in one atomic
+    request, so searches never see an empty or partial index.
+    """
     doc_types = [Activiteit, Locatie, Organisatie, Term]
     index = settings.ELASTIC_INDEX
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delete', action='store_true',
+            help='Delete the alias and all versions of the index')
+        parser.add_argument(
+            '--build', action='store_true',
+            help='Build a new version of the index and swap the alias to it '
+                 '(default)')
+        parser.add_argument(
+            '--reindex', action='store_true',
+            help='Reload rows into the live index, in place')
+        parser.add_argument(
+            '--doctype', action='append', choices=self.sources().keys(),
+            help='Only reindex the given doctype(s), used with --reindex')
+        parser.add_argument(
+            '--chunk-size', type=int, default=settings.ELASTIC_BULK_CHUNK_SIZE,
+            help='Number of documents per bulk request')
+        parser.add_argument(
+            '--thread-count', type=int, default=settings.ELASTIC_BULK_THREADS,
+            help='Number of parallel bulk requests')
+
     def handle(self, *args, **options):
         start = time.time()
-        self.create_index()
+        self.__connect_to_elastic()
+        bulk_options = options['chunk_size'], options['thread_count']
+        if options['delete']:
+            self.delete_index()
+        if options['reindex']:
+            self.reindex(
+                self.index, options['doctype'] or self.sources().keys(),
+                *bulk_options)
+        elif options['build'] or not options['delete']:
+            self.build(*bulk_options)
+        # Cached search responses are outdated now
+        versions.bump_index_generation()
         self.stdout.write("Total Duration: %.2f seconds" % (time.time() - start))
 
     def __connect_to_elastic(self):
-        # Creates a connection to elastic
-        connections.create_connection(
-            hosts=settings.ELASTIC_SEARCH_HOSTS,
-            retry_on_timeout=True,
-        )
-        return es.Index(self.index)
+        # The shared client, also the default elasticsearch_dsl connection
+        return elastic._elasticsearch()
+
+    def build(self, chunk_size, thread_count):
+        name = self.create_index()
+        self.reindex(name, self.sources().keys(), chunk_size, thread_count)
+        self.publish(name)
+        self.prune()
 
     def create_index(self):
-        # Creating a a new index and adding
-        # mapping to the doc_types
-        idx = self.__connect_to_elastic()
+        # Creating a a new version of the index and adding
+        # mapping to the doc_types. Settings are tuned for bulk loading
+        # until the index gets published.
+        name = '{}_{}'.format(self.index, time.strftime('%Y%m%d%H%M%S'))
+        idx = es.Index(name)
+        idx.settings(number_of_replicas=0, refresh_interval='-1')
         for dt in self.doc_types:
             idx.doc_type(dt)
         idx.create()
+        self.stdout.write("Created index %s" % name)
+        return name
+
+    def versions(self):
+        """Physical indices behind the alias, oldest first."""
+        client = self.__connect_to_elastic()
+        version = re.compile(r'^{}_\d{{14}}$'.format(re.escape(self.index)))
+        return sorted(
+            name for name in client.indices.get(
+                index='{}_*'.format(self.index), ignore_unavailable=True)
+            if version.match(name))
+
+    def live_versions(self):
+        client = self.__connect_to_elastic()
+        if not client.indices.exists_alias(name=self.index):
+            return []
+        return list(client.indices.get_alias(name=self.index))
+
+    def publish(self, name):
+        """Restore the search settings of `name` and atomically point the
+        alias to it."""
+        client = self.__connect_to_elastic()
+        client.indices.put_settings(index=name, body={'index': {
+            'number_of_replicas': settings.ELASTIC_INDEX_REPLICAS,
+            'refresh_interval': settings.ELASTIC_INDEX_REFRESH_INTERVAL,
+        }})
+        client.indices.refresh(index=name)
+        client.cluster.health(
+            index=name, wait_for_status='yellow', request_timeout=300)
+
+        actions = [{'add': {'index': name, 'alias': self.index}}]
+        actions.extend(
+            {'remove': {'index': old, 'alias': self.index}}
+            for old in self.live_versions())
+        if not actions[1:] and client.indices.exists(index=self.index):
+            # A concrete index from before we used aliases is in the way
+            actions.append({'remove_index': {'index': self.index}})
+        client.indices.update_aliases(body={'actions': actions})
+        self.stdout.write("Alias %s now points to %s" % (self.index, name))
+
+    def prune(self):
+        """Delete old versions, keeping `ELASTIC_INDEX_RETENTION` of them
+        besides the live one(s)."""
+        client = self.__connect_to_elastic()
+        live = set(self.live_versions())
+        old = [name for name in self.versions() if name not in live]
+        keep = settings.ELASTIC_INDEX_RETENTION
+        for name in old[:max(len(old) - keep, 0)]:
+            client.indices.delete(index=name)
+            self.stdout.write("Deleted index %s" % name)
+
+    def delete_index(self):
+        client = self.__connect_to_elastic()
+        for name in set(self.versions()) | set(self.live_versions()):
+            client.indices.delete(index=name)
+        client.indices.delete(index=self.index, ignore=404)
+
+    @staticmethod
+    def sources():
+        """Generators of ES documents per doctype."""
+        return {
+            'activiteit': lambda size: (
+                documents.from_activiteit(a) for a in _batches(
+                    models.Activiteit.objects
+                    .select_related('locatie', 'organisatie')
+                    .prefetch_related('tags'), size)),
+            'locatie': lambda size: (
+                documents.from_locatie(loc) for loc in _batches(
+                    models.Locatie.objects.all(), size)),
+            'organisatie': lambda size: (
+                documents.from_organisatie(o) for o in _batches(
+                    models.Organisatie.objects.all(), size)),
+            'term': lambda size: (
+                documents.from_term(term, gewicht)
+                for term, gewicht in terms.generate(size)),
+        }
+
+    def reindex(self, index, doctypes, chunk_size, thread_count):
+        """Bulk load the given doctypes into `index` and report the
+        throughput of each."""
+        sources = self.sources()
+        for doctype in doctypes:
+            start = time.time()
+            actions = (
+                dict(doc.to_dict(include_meta=True, skip_empty=False),
+                     _index=index)
+                for doc in sources[doctype](chunk_size))
+            ok, failed = self.bulk(actions, chunk_size, thread_count)
+            duration = time.time() - start
+            self.stdout.write(
+                "%s: %d indexed, %d failed in %.2f seconds (%.0f docs/sec)" % (
+                    doctype, ok, failed, duration, ok / max(duration, 1e-6)))
+
+    def bulk(self, actions, chunk_size, thread_count):
+        ok = failed = 0
+        results = parallel_bulk(
+            self.__connect_to_elastic(), actions,
+            chunk_size=chunk_size, thread_count=thread_count,
+            raise_on_error=False)
+        for success, info in results:
+            if success:
+                ok += 1
+            else:
+                failed += 1
+                log.error('Failed to index document: %s', info)
+        return ok, failed
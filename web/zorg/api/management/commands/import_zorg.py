@@ -0,0 +1,97 @@
+import os
+import time
+import zipfile
+
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from datasets.normalized import importer, models, sync, versions
+
+
+class Command(BaseCommand):
+    """Import organisaties, locaties and activiteiten of one profile.
+
+    Reads xlsx workbooks with a sheet per doctype, and JSON files holding
+    an array of records of one doctype. Ids are turned into guids with the
+    guid of the profile, as the API does. Nothing is written unless all
+    files could be read.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='.xlsx or .json files')
+        parser.add_argument(
+            '--profile', required=True,
+            help='Guid of the profile that owns the records')
+        parser.add_argument(
+            '--doctype', choices=importer.FIELDS.keys(),
+            help='Doctype of the JSON files, by default taken from their name')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only show what the import would change')
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Number of records per COPY')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        try:
+            profile = models.Profile.objects.get(guid=options['profile'])
+        except models.Profile.DoesNotExist:
+            raise CommandError(f"Unknown profile {options['profile']}")
+
+        with transaction.atomic():
+            loader = importer.Importer(profile, options['chunk_size'])
+            for path in options['files']:
+                # The records are read while they are staged
+                try:
+                    for doctype, records in self.read(path, options['doctype']):
+                        loader.stage(doctype, records)
+                except (OSError, ValueError, zipfile.BadZipFile) as e:
+                    raise CommandError(f'Could not read {path}: {e}')
+            if not any(loader.staged.values()):
+                raise CommandError('Nothing to import')
+            loader.check()
+            for doctype, record, error in loader.errors:
+                self.stderr.write(f'{doctype} {record}: {error}')
+            self.stdout.write('Staged %s in %.2f seconds' % (
+                ', '.join(f'{n} {doctype}' for doctype, n in loader.staged.items()),
+                time.time() - start))
+
+            if options['dry_run']:
+                self.report(loader.diff(), options['verbosity'])
+                transaction.set_rollback(True)
+                return
+
+            changed, result = loader.merge()
+            for doctype, guids in changed.items():
+                sync.mark_dirty(doctype, guids)
+            versions.touch(*changed)
+        for doctype, counts in result.items():
+            self.stdout.write('%s: %s' % (doctype, ', '.join(
+                f'{count} {name}' for name, count in counts.items())))
+        self.stdout.write("Total Duration: %.2f seconds" % (time.time() - start))
+
+    def read(self, path, doctype):
+        """(doctype, records) in the file at `path`."""
+        name, extension = os.path.splitext(os.path.basename(path))
+        if extension.lower() == '.xlsx':
+            yield from importer.read_xlsx(path)
+        elif extension.lower() == '.json':
+            doctype = doctype or next(
+                (d for d in importer.FIELDS if d in name.lower()), None)
+            if doctype is None:
+                raise CommandError(f'Pass --doctype for {path}')
+            with open(path, encoding='utf-8') as file:
+                yield doctype, importer.read_json(file)
+        else:
+            raise CommandError(f'Can only import .xlsx and .json: {path}')
+
+    def report(self, diff, verbosity):
+        for doctype, changes in diff.items():
+            self.stdout.write('%s: %s' % (doctype, ', '.join(
+                f"{change['count']} {name}" for name, change in changes.items())))
+            if verbosity > 1:
+                for name, change in changes.items():
+                    if name != 'unchanged' and change['examples']:
+                        self.stdout.write(
+                            f"  {name}: {', '.join(change['examples'])}")
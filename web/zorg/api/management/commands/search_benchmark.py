@@ -0,0 +1,94 @@
+import copy
+import statistics
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from datasets.normalized import elastic, registry
+
+
+def as_scoring(body):
+    """`body` the way it was before doctype and tags became filters: those
+    in `must`, the text query in `should`."""
+    body = copy.deepcopy(body)
+    bools = body['query']['function_score']['query']['bool']
+    match = bools.pop('must')
+    if 'match_all' not in match:
+        bools['should'] = match
+    filters = bools.pop('filter', None)
+    if filters:
+        bools['must'] = filters
+    return body
+
+
+def _score_count(profile):
+    """Documents scored by the top level queries, over all shards."""
+    return sum(
+        query['breakdown'].get('score_count', 0)
+        for shard in profile['shards']
+        for search in shard['searches']
+        for query in search['query'])
+
+
+class Command(BaseCommand):
+    """Profile tag searches with scoring and with filtering constraints.
+
+    Runs every search a number of times against the live index with the
+    profile API, and compares the number of scored documents, the time
+    Elastic took and the hits on its query cache.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tag', action='append', dest='tags',
+            help='Tag to search for, can be repeated. '
+                 'By default every tag is searched for on its own.')
+        parser.add_argument('--query', default='', help='Text query')
+        parser.add_argument('--doctype', help='Restrict to one doctype')
+        parser.add_argument(
+            '--repeat', type=int, default=10,
+            help='Number of times every search runs')
+
+    def handle(self, *args, **options):
+        searches = [[tag] for tag in registry.tags().names()]
+        if options['tags']:
+            try:
+                searches = [registry.tags().normalize(options['tags'])]
+            except ValueError as e:
+                raise CommandError(e)
+        if not searches:
+            self.stderr.write("There are no tags")
+            return
+
+        bodies = [
+            elastic.query(options['query'], options['doctype'], tags=tags)
+            for tags in searches]
+        self.report('filter', bodies, options['repeat'])
+        self.report('scoring', [as_scoring(body) for body in bodies],
+                    options['repeat'])
+
+    def report(self, name, bodies, repeat):
+        es = elastic._elasticsearch()
+        before = self.query_cache(es)
+        took, scored = [], []
+        for _ in range(repeat):
+            for body in bodies:
+                response = es.search(
+                    index=settings.ELASTIC_INDEX, body=dict(body, profile=True),
+                    request_cache=False)
+                took.append(response['took'])
+                scored.append(_score_count(response['profile']))
+        after = self.query_cache(es)
+        self.stdout.write(
+            "%s: took mean %.1f ms, p95 %d ms; scored docs mean %.0f; "
+            "query cache %d hits, %d misses" % (
+                name, statistics.mean(took),
+                sorted(took)[int(len(took) * 0.95)], statistics.mean(scored),
+                after['hit_count'] - before['hit_count'],
+                after['miss_count'] - before['miss_count']))
+
+    @staticmethod
+    def query_cache(es):
+        stats = es.indices.stats(
+            index=settings.ELASTIC_INDEX, metric='query_cache')
+        return stats['_all']['total']['query_cache']
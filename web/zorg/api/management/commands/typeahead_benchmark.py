@@ -0,0 +1,58 @@
+import random
+import statistics
+import time
+
+from django.core.management import BaseCommand
+
+from api import typeahead
+from datasets.normalized import elastic
+
+
+class Command(BaseCommand):
+    """Compare the latency of the typeahead engines.
+
+    Replays prefixes of the vocabulary, like keystrokes, against the
+    in-process index and against Elastic, bypassing the response cache.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queries', type=int, default=500,
+            help='Number of prefixes to look up')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Seed for picking the prefixes')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        index = typeahead.build()
+        self.stdout.write("Built index of %d terms in %.2f seconds" % (
+            len(index), time.time() - start))
+
+        if not len(index):
+            self.stderr.write("The vocabulary is empty")
+            return
+        rng = random.Random(options['seed'])
+        terms = index.terms
+        prefixes = []
+        while len(prefixes) < options['queries']:
+            term = rng.choice(terms)
+            prefixes.extend(
+                term[:length] for length in range(1, min(len(term), 8) + 1))
+        prefixes = prefixes[:options['queries']]
+
+        self.report('memory', index.suggest, prefixes)
+        self.report('elastic', elastic.typeahead, prefixes)
+
+    def report(self, name, lookup, prefixes):
+        timings = []
+        for prefix in prefixes:
+            start = time.perf_counter()
+            lookup(prefix)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        self.stdout.write(
+            "%s: mean %.3f ms, p50 %.3f ms, p95 %.3f ms, max %.3f ms" % (
+                name, statistics.mean(timings),
+                timings[len(timings) // 2],
+                timings[int(len(timings) * 0.95)], timings[-1]))
@@ -0,0 +1,56 @@
+# Python
+from unittest import mock
+
+# Packages
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+# Project
+from api.cache import LRUCache, ResponseCache, normalize_query
+from datasets.normalized import versions
+
+
+class LRUCacheTest(SimpleTestCase):
+
+    def test_evicts_least_recently_used(self):
+        lru = LRUCache(maxsize=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'))
+
+    def test_expires(self):
+        lru = LRUCache(maxsize=2, ttl=60)
+        with mock.patch('api.cache.time.monotonic', return_value=0):
+            lru.set('a', 1)
+        with mock.patch('api.cache.time.monotonic', return_value=61):
+            self.assertIsNone(lru.get('a'))
+
+
+@override_settings(SEARCH_CACHE_GENERATION_CHECK=0)
+class ResponseCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.compute = mock.Mock(return_value='{}')
+
+    def test_tiers(self):
+        responses = ResponseCache('test', 60)
+        self.assertEqual(responses.get_or_compute(['q'], self.compute), ('{}', 'miss'))
+        self.assertEqual(responses.get_or_compute(['q'], self.compute), ('{}', 'local'))
+        # Another process
+        other = ResponseCache('test', 60)
+        self.assertEqual(other.get_or_compute(['q'], self.compute), ('{}', 'shared'))
+        self.assertEqual(self.compute.call_count, 1)
+
+    def test_new_generation_invalidates(self):
+        responses = ResponseCache('test', 60)
+        responses.get_or_compute(['q'], self.compute)
+        versions.bump_index_generation()
+        self.assertEqual(responses.get_or_compute(['q'], self.compute)[1], 'miss')
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query('  Yoga   IN het park '), 'yoga in het park')
+        self.assertEqual(normalize_query(None), '')
@@ -0,0 +1,36 @@
+# Python
+import io
+from unittest import mock
+
+# Packages
+from django.test import SimpleTestCase, override_settings
+
+# Project
+from api.management.commands.elastic import Command
+
+_INDICES = ['zorg_20190101000000', 'zorg_20190102000000', 'zorg_20190103000000']
+
+
+@mock.patch('api.management.commands.elastic.elastic._elasticsearch')
+class PruneTest(SimpleTestCase):
+
+    def prune(self, client):
+        client.return_value.indices.get.return_value = {
+            name: {} for name in _INDICES}
+        client.return_value.indices.exists_alias.return_value = True
+        client.return_value.indices.get_alias.return_value = {_INDICES[-1]: {}}
+        Command(stdout=io.StringIO()).prune()
+        return [call[1]['index'] for call
+                in client.return_value.indices.delete.call_args_list]
+
+    @override_settings(ELASTIC_INDEX_RETENTION=1)
+    def test_keeps_the_newest(self, client):
+        self.assertEqual(self.prune(client), [_INDICES[0]])
+
+    @override_settings(ELASTIC_INDEX_RETENTION=0)
+    def test_no_retention(self, client):
+        self.assertEqual(self.prune(client), _INDICES[:2])
+
+    @override_settings(ELASTIC_INDEX_RETENTION=5)
+    def test_retention_beyond_the_indices(self, client):
+        self.assertEqual(self.prune(client), [])
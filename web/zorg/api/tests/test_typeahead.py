@@ -0,0 +1,66 @@
+# Python
+from unittest import mock
+
+# Packages
+from django.test import SimpleTestCase, override_settings
+
+# Project
+from api import typeahead
+
+
+class PrefixIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        self.index = typeahead.PrefixIndex({
+            'yoga': 5, 'hatha yoga': 9, 'yoghurt': 1, 'zwemmen': 3,
+            'aqua yoga les': 2,
+        }, size=3, precompute=2)
+
+    def test_best_first(self):
+        self.assertEqual(
+            self.index.suggest('yo'), ['hatha yoga', 'yoga', 'aqua yoga les'])
+        self.assertEqual(self.index.suggest(''), ['hatha yoga', 'yoga', 'zwemmen'])
+
+    def test_long_prefixes(self):
+        self.assertEqual(self.index.suggest('yogh'), ['yoghurt'])
+        self.assertEqual(self.index.suggest('yoga l'), ['aqua yoga les'])
+        self.assertEqual(self.index.suggest('xyz'), [])
+
+
+class IndexTest(SimpleTestCase):
+
+    def tearDown(self):
+        typeahead._index = None
+
+    @override_settings(TYPEAHEAD_REBUILD_INTERVAL=0)
+    @mock.patch('api.typeahead.versions.terms_generation')
+    @mock.patch('api.typeahead.terms.vocabulary')
+    def test_rebuilt_for_new_generation(self, vocabulary, generation):
+        vocabulary.return_value = {'yoga': 1}
+        generation.return_value = 1
+        typeahead._index = None
+        self.assertEqual(typeahead.typeahead('yo'), '["yoga"]')
+
+        vocabulary.return_value = {'yoga': 1, 'yoghurt': 2}
+        generation.return_value = 2
+        typeahead._checked = 0
+        with mock.patch('api.typeahead.threading.Thread') as thread:
+            # The old index serves while the new one is built
+            self.assertEqual(typeahead.typeahead('yo'), '["yoga"]')
+        target = thread.call_args[1]
+        target['target'](*target['args'])
+        self.assertEqual(typeahead.typeahead('yo'), '["yoghurt", "yoga"]')
+
+    @override_settings(TYPEAHEAD_REBUILD_INTERVAL=3600)
+    @mock.patch('api.typeahead.versions.terms_generation')
+    @mock.patch('api.typeahead.terms.vocabulary')
+    def test_rebuild_interval(self, vocabulary, generation):
+        vocabulary.return_value = {'yoga': 1}
+        generation.return_value = 1
+        typeahead._index = None
+        typeahead.index()
+        generation.return_value = 2
+        typeahead._checked = 0
+        with mock.patch('api.typeahead.threading.Thread') as thread:
+            typeahead.index()
+        thread.assert_not_called()
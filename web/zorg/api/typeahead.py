@@ -0,0 +1,138 @@
+"""In-process typeahead, an alternative to the Elastic completion suggester.
+
+The vocabulary is small, so every process keeps it in a sorted array of
+normalized suggest inputs, with the top suggestions of short prefixes
+precomputed. Longer prefixes select a (small) range of the array with
+bisect. The array is built from the same vocabulary as the ``Term``
+documents. It is rebuilt in the background when the terms generation of
+:mod:`versions` changes, at most once per TYPEAHEAD_REBUILD_INTERVAL seconds.
+
+Used when TYPEAHEAD_ENGINE is ``'memory'``.
+"""
+import bisect
+import collections
+import heapq
+import json
+import logging
+import threading
+import time
+from array import array
+
+from django.conf import settings
+
+# Project
+from datasets.normalized import elastic, terms, versions
+
+_logger = logging.getLogger(__name__)
+
+
+class PrefixIndex:
+    """Sorted suggest inputs with the best `size` terms per prefix.
+
+    Like the ``Term`` suggester, every word of a term starts an input, and
+    terms are ranked by gewicht, then alphabetically.
+    """
+
+    def __init__(self, weights, size=elastic.TYPEAHEAD_SIZE, precompute=3):
+        self.size = size
+        self.precompute = precompute
+        # Terms by rank, best first
+        self.terms = sorted(weights, key=lambda term: (-weights[term], term))
+        entries = sorted(
+            (' '.join(words[i:]), rank)
+            for rank, words in enumerate(term.split() for term in self.terms)
+            for i in range(len(words)))
+        self.keys = [key for key, _ in entries]
+        self.ranks = array('I', (rank for _, rank in entries))
+
+        prefixes = collections.defaultdict(set)
+        for key, rank in entries:
+            for length in range(min(len(key), precompute) + 1):
+                prefixes[key[:length]].add(rank)
+        self.top = {
+            prefix: array('I', heapq.nsmallest(size, ranks))
+            for prefix, ranks in prefixes.items()}
+
+    def __len__(self):
+        return len(self.terms)
+
+    def suggest(self, q):
+        """Best terms with a word starting with `q`."""
+        if len(q) <= self.precompute:
+            ranks = self.top.get(q, ())
+        else:
+            lo = bisect.bisect_left(self.keys, q)
+            hi = bisect.bisect_left(self.keys, q + '\uffff', lo)
+            ranks = heapq.nsmallest(self.size, set(self.ranks[lo:hi]))
+        return [self.terms[rank] for rank in ranks]
+
+
+def build() -> PrefixIndex:
+    start = time.time()
+    weights = collections.Counter()
+    for term, gewicht in terms.vocabulary().items():
+        weights[' '.join(term.split())] += gewicht
+    index = PrefixIndex(weights)
+    _logger.info('Built typeahead index of %d terms in %.2f seconds',
+                 len(index), time.time() - start)
+    return index
+
+
+_lock = threading.Lock()
+_index = None
+_generation = None
+_checked = 0
+_built = 0
+
+
+def _rebuild(generation):
+    global _index, _generation, _built
+    try:
+        _index, _generation = build(), generation
+    except Exception:
+        _logger.exception('Could not rebuild the typeahead index')
+    finally:
+        _built = time.monotonic()
+        _lock.release()
+
+
+def index() -> PrefixIndex:
+    """The index of this process, rebuilt when the terms changed.
+
+    The generation is looked up at most once per
+    SEARCH_CACHE_GENERATION_CHECK seconds. Only the first build blocks,
+    later ones run in a thread while requests keep using the old index.
+    """
+    global _index, _generation, _checked, _built
+    now = time.monotonic()
+    if _index is not None and \
+            now - _checked < settings.SEARCH_CACHE_GENERATION_CHECK:
+        return _index
+    _checked = now
+    generation = versions.terms_generation()
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index, _generation = build(), generation
+                _built = time.monotonic()
+    elif generation != _generation and \
+            now - _built >= settings.TYPEAHEAD_REBUILD_INTERVAL and \
+            _lock.acquire(blocking=False):
+        threading.Thread(
+            target=_rebuild, args=(generation,), daemon=True).start()
+    return _index
+
+
+def typeahead(q):
+    """JSON encoded search suggestions, like `elastic.typeahead`."""
+    return json.dumps(index().suggest(q))
+
+
+def warm():
+    """Build the index ahead of the first request, if it's used."""
+    if settings.TYPEAHEAD_ENGINE != 'memory':
+        return
+    try:
+        index()
+    except Exception:
+        _logger.exception('Could not build the typeahead index')
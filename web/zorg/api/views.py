@@ -4,33 +4,84 @@
     Reorganize this code and implement content negotiation.
 """
 import functools
+import json
 import logging
 import os
+import re
 import sys
 
-from django.http import HttpResponse, HttpResponseServerError
+from django.conf import settings
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, HttpResponseServerError)
 from django.views.decorators.http import require_GET
 
 # Project
-from datasets.normalized import elastic
+from api import typeahead as typeahead_engine
+from api.cache import normalize_query, search_cache, typeahead_cache
+from datasets.normalized import elastic, postgis, registry
 
 _logger = logging.getLogger(__name__)
 
+_FIELD = re.compile(r'^[\w.]+$')
+
+
+def search_params(queryparams, doctype=None):
+    """Normalized arguments for `elastic.search` from the query parameters.
+
+    Raises ValueError for invalid parameters.
+    """
+    lon, lat = queryparams.get('lon'), queryparams.get('lat')
+    lonlat = lon and lat and (float(lon), float(lat))
+    if lonlat and settings.SEARCH_GEO_GRID:
+        lonlat = elastic.snap_lonlat(lonlat, settings.SEARCH_GEO_GRID)
+    fields = sorted(set(filter(None, queryparams.get('fields', '').split(','))))
+    if not all(_FIELD.match(field) for field in fields):
+        raise ValueError('Invalid fields')
+    size, after = _page(queryparams)
+    return dict(
+        q=normalize_query(queryparams.get('query')),
+        doctype=doctype,
+        lonlat=lonlat or None,
+        tags=registry.tags().normalize(queryparams.getlist('tag')),
+        fields=fields,
+        compact=queryparams.get('profile') == 'compact',
+        size=size,
+        after=after,
+        facets=queryparams.get('facets') == 'true',
+    )
+
+
+def _page(queryparams):
+    """Page size and search_after values of the request."""
+    size = int(queryparams.get('size', settings.SEARCH_PAGE_SIZE))
+    if not 0 < size <= settings.SEARCH_MAX_PAGE_SIZE:
+        raise ValueError(
+            f'size should be between 1 and {settings.SEARCH_MAX_PAGE_SIZE}')
+    after = queryparams.get('after')
+    if after is not None:
+        after = json.loads(after)
+        if not (isinstance(after, list) and len(after) == 2 and
+                isinstance(after[0], (int, float)) and
+                isinstance(after[1], str)):
+            raise ValueError('after should be the sort value of a hit')
+    return size, after
+
 
 @require_GET
 def search(request, doctype=None):
     """Perform a search"""
-    queryparams = request.GET
-    # this is ugly!! is it lazy? because in that case I would rather create a
-    # QueryDict instance from META['query_string']
-    q = queryparams.get('query')
-    tags = queryparams.getlist('tag')
-    lon, lat = queryparams.get('lon'), queryparams.get('lat')
-    lonlat = lon and lat and (float(lon), float(lat))
     try:
-        return HttpResponse(
-            elastic.search(q, doctype, lonlat, tags),
-            content_type='application/json')
+        params = search_params(request.GET, doctype)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    try:
+        body, tier = search_cache.get_or_compute(
+            ['search', params], lambda: elastic.search(**params),
+            labels=['geo'] if params['lonlat'] else [])
+        return _cached_response(body, tier)
+    except elastic.CircuitOpen:
+        if not settings.SEARCH_FALLBACK:
+            return HttpResponse(status=503)
     except elastic.SearchError:
         _logger.critical('Exception while searching', exc_info=sys.exc_info())
         return HttpResponseServerError()
@@ -39,18 +90,26 @@ def search(request, doctype=None):
             'Unexpected exception while searching', exc_info=sys.exc_info())
         return HttpResponseServerError()
 
+    # Elastic is down, not cached so we're back on it as soon as it recovers
+    try:
+        return _cached_response(postgis.search(**params), 'fallback')
+    except elastic.SearchError:
+        _logger.critical('Exception while searching', exc_info=sys.exc_info())
+        return HttpResponseServerError()
+
 
 @require_GET
 def typeahead(request):
     """Perform a search"""
-    queryparams = request.GET
-    # this is ugly!! is it lazy? because in that case I would rather create a
-    # QueryDict instance from META['query_string']
-    q = queryparams.get('query')
+    q = normalize_query(request.GET.get('query'))
     try:
-        return HttpResponse(
-            elastic.typeahead(q),
-            content_type='application/json')
+        if settings.TYPEAHEAD_ENGINE == 'memory':
+            return _cached_response(typeahead_engine.typeahead(q), 'memory')
+        body, tier = typeahead_cache.get_or_compute(
+            ['typeahead', q], lambda: elastic.typeahead(q))
+        return _cached_response(body, tier)
+    except elastic.CircuitOpen:
+        return HttpResponse(status=503)
     except elastic.SearchError:
         _logger.critical('Exception while searching', exc_info=sys.exc_info())
         return HttpResponseServerError()
@@ -60,6 +119,12 @@ def typeahead(request):
         return HttpResponseServerError()
 
 
+def _cached_response(body, tier):
+    response = HttpResponse(body, content_type='application/json')
+    response['X-Cache'] = tier
+    return response
+
+
 @require_GET
 def openapi(request):
     """Server the OpenAPI spec.
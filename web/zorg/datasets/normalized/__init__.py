@@ -0,0 +1 @@
+default_app_config = 'datasets.normalized.apps.NormalizedConfig'
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Locatie, Organisatie, Activiteit, Persoon, Profile, TagDefinition
+from .models import Locatie, Organisatie, Activiteit, Persoon, Profile, TagDefinition, BatchJob
 
 
 class TagDefinitionAdmin(admin.ModelAdmin):
@@ -40,9 +40,16 @@ class ProfileAdmin(admin.ModelAdmin):
     pass
 
 
+class BatchJobAdmin(admin.ModelAdmin):
+    fields = ('auth_user', 'guid', 'status', 'result', 'created', 'started', 'finished')
+    readonly_fields = fields
+    list_display = ('id', 'guid', 'status', 'created', 'finished')
+
+
 admin.site.register(Locatie, LocatieAdmin)
 admin.site.register(TagDefinition, TagDefinitionAdmin)
 admin.site.register(Organisatie, OrganisatieAdmin)
 admin.site.register(Activiteit, ActiviteitAdmin)
 admin.site.register(Persoon, PersoonAdmin)
 admin.site.register(Profile, ProfileAdmin)
+admin.site.register(BatchJob, BatchJobAdmin)
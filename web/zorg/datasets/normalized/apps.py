@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class NormalizedConfig(AppConfig):
+    name = 'datasets.normalized'
+    label = 'normalized'
+
+    def ready(self):
+        # Connect the signal handlers that keep the search index, the guid
+        # prefix cache, the tag registry and the modification stamps in sync
+        from . import registry, serializers, sync, versions  # noqa: F401
@@ -0,0 +1,366 @@
+"""Asynchronous processing of /zorg/batch_update payloads.
+
+A payload is a list of operations, each pairing a ``locatie`` with an
+``activiteit``::
+
+    {"operatie": "insert" | "patch" | "delete",
+     "locatie": <locatie record or guid>,
+     "activiteit": <activiteit record or guid>}
+
+The view stores a ``BatchJob`` and queues :func:`process`. The job handles the
+records in chunks, each in a single transaction with set-based writes: one
+query to find the existing rows, ``bulk_create`` for new ones and
+``bulk_update`` for the others. Records that fail validation are reported per
+record in ``BatchJob.result`` and don't stop the rest of the batch.
+"""
+import logging
+import time
+
+import django_rq
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import coordinates, models, registry, sync, versions
+from .serializers import guid_from_id
+
+_logger = logging.getLogger(__name__)
+
+OPERATIONS = ('insert', 'patch', 'update', 'delete')
+
+LOCATIE_FIELDS = (
+    'id', 'naam', 'openbare_ruimte_naam', 'postcode', 'huisnummer',
+    'huisletter', 'huisnummer_toevoeging', 'bag_link', 'geometrie',
+)
+ACTIVITEIT_FIELDS = (
+    'id', 'naam', 'beschrijving', 'bron_link', 'contactpersoon', 'start_time',
+    'end_time', 'locatie_id', 'organisatie_id',
+)
+_PARSERS = {
+    'geometrie': lambda value: value and GEOSGeometry(value),
+    'start_time': lambda value: value and parse_datetime(value),
+    'end_time': lambda value: value and parse_datetime(value),
+}
+# Relations are checked in bulk, not by full_clean
+_CLEAN_EXCLUDE = ('guid', 'locatie', 'organisatie', 'persoon', 'tags')
+
+
+class RecordError(Exception):
+    """A single batch record can't be processed."""
+
+
+def enqueue(user: User, records: list) -> models.BatchJob:
+    """Store a new job for `records` and queue it.
+
+    Small batches go to the ``high`` queue so they aren't stuck behind the
+    big nightly loads on ``low``.
+    """
+    job = models.BatchJob.objects.create(
+        auth_user=user, guid=guid_from_id(user, ''),
+        result={'total': len(records)})
+    queue = 'high' if len(records) <= settings.BATCH_HIGH_PRIORITY_MAX else 'low'
+    django_rq.get_queue(queue).enqueue(process, job.pk, records)
+    return job
+
+
+def process(job_id: int, records: list):
+    """RQ job: apply `records` chunk by chunk, keeping track of the progress
+    in the BatchJob."""
+    job = models.BatchJob.objects.get(pk=job_id)
+    job.status = 'running'
+    job.started = timezone.now()
+    job.save(update_fields=['status', 'started'])
+
+    result = dict(
+        total=len(records), processed=0, added=0, updated=0, deleted=0,
+        errors=[])
+    start = time.time()
+    try:
+        chunk_size = settings.BATCH_CHUNK_SIZE
+        for offset in range(0, len(records), chunk_size):
+            _process_chunk(
+                job.guid, list(enumerate(
+                    records[offset:offset + chunk_size], offset)), result)
+            _progress(job, result, start)
+        failed = records and _failed(result) == len(records)
+        job.status = 'failed' if failed else 'success'
+    except Exception:
+        _logger.exception('Batch job %s failed', job_id)
+        job.status = 'failed'
+    job.finished = timezone.now()
+    _progress(job, result, start)
+
+
+def _progress(job, result, start):
+    duration = time.time() - start
+    job.result = dict(
+        result, duration=round(duration, 3),
+        records_per_second=round(result['processed'] / max(duration, 1e-6), 1),
+        messages=f"{_failed(result)} record(s) failed")
+    job.save(update_fields=['status', 'result', 'finished'])
+
+
+def _failed(result):
+    """Number of records with errors, one record can have several."""
+    return len({error['index'] for error in result['errors']})
+
+
+def _process_chunk(prefix, chunk, result):
+    upserts, deletes = [], []
+    for index, record in chunk:
+        try:
+            operatie = record.get('operatie')
+            if operatie not in OPERATIONS:
+                raise RecordError(f'Unknown operatie {operatie!r}')
+            if operatie == 'delete':
+                deletes.append((index, _delete_guids(prefix, record)))
+            else:
+                for key in ('locatie', 'activiteit'):
+                    if record.get(key) is not None and \
+                            not isinstance(record[key], dict):
+                        raise RecordError(f'{key} should be an object')
+                upserts.append((index, operatie, record))
+        except (RecordError, AttributeError, TypeError) as e:
+            _error(result, index, record, e)
+
+    # Counted apart, they only hold once the chunk commits
+    written = dict(added=0, updated=0, deleted=0, errors=[])
+    try:
+        with transaction.atomic():
+            _upsert(prefix, upserts, written)
+            _delete(deletes, written)
+    except Exception as e:
+        # One bad write rolls back the chunk, report it on all its records
+        _logger.exception('Batch chunk failed')
+        records = dict(chunk)
+        for index in sorted({index for index, *_ in upserts + deletes}):
+            _error(result, index, records[index], e)
+    else:
+        for key in ('added', 'updated', 'deleted'):
+            result[key] += written[key]
+        result['errors'].extend(written['errors'])
+    result['processed'] += len(chunk)
+
+
+def _error(result, index, record, error):
+    if isinstance(error, ValidationError):
+        message = getattr(error, 'message_dict', None) or error.messages
+    else:
+        message = str(error)
+    operatie = record.get('operatie') if isinstance(record, dict) else None
+    result['errors'].append(
+        {'index': index, 'operatie': operatie, 'message': message})
+
+
+def _guid(prefix, value):
+    """Guid of a record given as a dict with an `id`, or as a guid."""
+    if isinstance(value, dict):
+        if not value.get('id'):
+            raise RecordError('Missing id')
+        return f"{prefix}-{value['id']}"
+    if not isinstance(value, str) or not value.startswith(f'{prefix}-'):
+        raise RecordError(f'{value!r} is not one of your guids')
+    return value
+
+
+_DELETE_MODELS = {'activiteit': models.Activiteit, 'locatie': models.Locatie}
+
+
+def _delete_guids(prefix, record):
+    """{key: guid} of the activiteit and locatie to delete."""
+    return {
+        key: _guid(prefix, record[key])
+        for key in _DELETE_MODELS if record.get(key)}
+
+
+def _delete(deletes, result):
+    # Activiteiten and locaties may share a guid, delete each from its own table
+    for key, model in _DELETE_MODELS.items():
+        guids = [
+            record_guids[key] for _, record_guids in deletes
+            if key in record_guids]
+        if guids:
+            _, counts = model.objects.filter(guid__in=guids).delete()
+            result['deleted'] += counts.get(model._meta.label, 0)
+
+
+def _apply(instance, data, fields):
+    changed = []
+    for field in fields:
+        if field in data:
+            value = data[field]
+            parse = _PARSERS.get(field)
+            setattr(instance, field, parse(value) if parse else value)
+            changed.append(field)
+    return changed
+
+
+def _build(model, fields, prefix, items, existing):
+    """Validated instances for `items` of (index, operatie, data).
+
+    Returns the instances and the record index per guid, the names of the
+    fields that were set and a list of (index, error).
+    """
+    instances, indexes, changed, errors = {}, {}, set(), []
+    for index, operatie, data in items:
+        try:
+            guid = _guid(prefix, data)
+            instance = existing.get(guid) or instances.get(guid)
+            if instance is None:
+                if operatie != 'insert':
+                    raise RecordError(f'{guid} does not exist')
+                instance = model(guid=guid)
+            changed.update(_apply(instance, data, fields))
+            instance.full_clean(exclude=_CLEAN_EXCLUDE, validate_unique=False)
+            instances[guid] = instance
+            indexes[guid] = index
+        except (RecordError, ValidationError, ValueError, TypeError) as e:
+            errors.append((index, e))
+    return instances, indexes, changed, errors
+
+
+def _save(model, instances, changed, existing, result):
+    new = [obj for guid, obj in instances.items() if guid not in existing]
+    old = [obj for guid, obj in instances.items() if guid in existing]
+    model.objects.bulk_create(new)
+    if old and changed:
+        # bulk_update leaves auto_now fields alone
+        now = timezone.now()
+        for obj in old:
+            obj.updated_at = now
+        model.objects.bulk_update(
+            old, sorted(field[:-3] if field.endswith('_id') else field
+                        for field in changed | {'updated_at'}))
+    result['added'] += len(new)
+    result['updated'] += len(old)
+
+
+def _upsert(prefix, upserts, result):
+    records = {index: record for index, _, record in upserts}
+    locaties = [
+        (index, operatie, record['locatie']) for index, operatie, record
+        in upserts if record.get('locatie')]
+    activiteiten = []
+    for index, operatie, record in upserts:
+        activiteit = record.get('activiteit')
+        if activiteit and record.get('locatie'):
+            # Default to the locatie that came with it
+            activiteit = dict(activiteit)
+            activiteit.setdefault(
+                'locatie_id', _guid(prefix, record['locatie']))
+        if activiteit:
+            activiteiten.append((index, operatie, activiteit))
+
+    existing_locaties = models.Locatie.objects.in_bulk(
+        [f"{prefix}-{data.get('id')}" for _, _, data in locaties])
+    loc_instances, _, loc_changed, errors = _build(
+        models.Locatie, LOCATIE_FIELDS, prefix, locaties, existing_locaties)
+    # One transformation for the whole chunk, bulk writes skip save()
+    coordinates.set_centroids(loc_instances.values())
+    if 'geometrie' in loc_changed:
+        loc_changed.add('centroid')
+
+    existing_activiteiten = models.Activiteit.objects.in_bulk(
+        [f"{prefix}-{data.get('id')}" for _, _, data in activiteiten])
+    act_instances, act_indexes, act_changed, act_errors = _build(
+        models.Activiteit, ACTIVITEIT_FIELDS, prefix, activiteiten,
+        existing_activiteiten)
+    errors.extend(act_errors)
+    errors.extend(
+        (act_indexes[guid], error) for guid, error
+        in _check_relations(act_instances, loc_instances))
+    tags, tag_errors = _resolve_tags(prefix, activiteiten)
+    errors.extend(tag_errors)
+
+    failed = {index for index, _ in errors}
+    for index, error in errors:
+        _error(result, index, records[index], error)
+    # Locaties are stored even if their activiteit fails, other records may
+    # use them too. An activiteit with a failed locatie fails on the relation
+    # check.
+    for index, _, data in activiteiten:
+        if index in failed:
+            act_instances.pop(f"{prefix}-{data.get('id')}", None)
+    for guid in set(tags) - set(act_instances):
+        del tags[guid]
+
+    _save(models.Locatie, loc_instances, loc_changed, existing_locaties, result)
+    _save(models.Activiteit, act_instances, act_changed,
+          existing_activiteiten, result)
+    _save_tags(tags)
+
+    # bulk_create and bulk_update don't send post_save
+    sync.mark_dirty('locatie', loc_instances)
+    sync.mark_dirty('activiteit', act_instances)
+    versions.touch('locatie', 'activiteit')
+
+
+def _check_relations(activiteiten, locaties):
+    """Make sure referenced locaties and organisaties exist, in two queries.
+
+    Returns a list of (guid, error).
+    """
+    locatie_ids = {a.locatie_id for a in activiteiten.values() if a.locatie_id}
+    organisatie_ids = {
+        a.organisatie_id for a in activiteiten.values() if a.organisatie_id}
+    known_locaties = set(locaties) | set(
+        models.Locatie.objects.filter(guid__in=locatie_ids - set(locaties))
+        .values_list('guid', flat=True))
+    known_organisaties = set(
+        models.Organisatie.objects.filter(guid__in=organisatie_ids)
+        .values_list('guid', flat=True))
+
+    errors = []
+    for guid, activiteit in activiteiten.items():
+        if activiteit.locatie_id and activiteit.locatie_id not in known_locaties:
+            errors.append((guid, RecordError(
+                f'Locatie {activiteit.locatie_id} does not exist')))
+        elif activiteit.organisatie_id and \
+                activiteit.organisatie_id not in known_organisaties:
+            errors.append((guid, RecordError(
+                f'Organisatie {activiteit.organisatie_id} does not exist')))
+    return errors
+
+
+def _resolve_tags(prefix, activiteiten):
+    """Tag ids per activiteit guid, resolved by the tag registry.
+
+    Names the registry doesn't know are looked up in the database, they may
+    have been defined since it was loaded.
+    """
+    names = {
+        naam for _, _, data in activiteiten
+        for naam in (data.get('tags') or ())}
+    ids = registry.tags().resolve(names)
+    unknown = names - set(ids)
+    if unknown:
+        ids.update(models.TagDefinition.objects.filter(naam__in=unknown)
+                   .values_list('naam', 'id'))
+    tags, errors = {}, []
+    for index, _, data in activiteiten:
+        if 'tags' not in data:
+            continue
+        unknown = [naam for naam in data['tags'] or () if naam not in ids]
+        if unknown:
+            errors.append((index, RecordError(f'Unknown tags {unknown}')))
+        else:
+            tags[f"{prefix}-{data.get('id')}"] = {
+                ids[naam] for naam in data['tags'] or ()}
+    return tags, errors
+
+
+def _save_tags(tags):
+    """Replace the tags of the given activiteiten."""
+    if not tags:
+        return
+    through = models.Activiteit.tags.through
+    through.objects.filter(activiteit_id__in=tags).delete()
+    through.objects.bulk_create(
+        through(activiteit_id=guid, tagdefinition_id=tag_id)
+        for guid, tag_ids in tags.items() for tag_id in tag_ids)
+    models.Activiteit.objects.filter(guid__in=tags).update(
+        updated_at=timezone.now())
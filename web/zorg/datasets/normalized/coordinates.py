@@ -0,0 +1,45 @@
+"""RD New (EPSG:28992) to WGS84 (EPSG:4326) for whole batches of points.
+
+Locaties keep a WGS84 ``centroid`` next to their RD ``geometrie``, so
+indexers, exports and searches get lon/lat without a PROJ call per row.
+Batches are transformed with one pyproj call on NumPy arrays.
+"""
+import functools
+
+import numpy
+import pyproj
+from django.contrib.gis.geos import Point
+
+RD = 28992
+WGS84 = 4326
+
+
+@functools.lru_cache(maxsize=1)
+def _transformer():
+    return pyproj.Transformer.from_crs(RD, WGS84, always_xy=True)
+
+
+def to_wgs84(points):
+    """WGS84 Points for a sequence of RD points, None stays None."""
+    points = list(points)
+    present = [i for i, point in enumerate(points) if point is not None]
+    result = [None] * len(points)
+    if not present:
+        return result
+    for i in present:
+        if points[i].srid not in (None, RD):
+            points[i] = points[i].transform(RD, clone=True)
+    xs = numpy.fromiter((points[i].x for i in present), float, len(present))
+    ys = numpy.fromiter((points[i].y for i in present), float, len(present))
+    lons, lats = _transformer().transform(xs, ys)
+    for i, lon, lat in zip(present, lons.tolist(), lats.tolist()):
+        result[i] = Point(lon, lat, srid=WGS84)
+    return result
+
+
+def set_centroids(locaties):
+    """Derive the centroid of every Locatie in `locaties` from its geometrie."""
+    locaties = list(locaties)
+    for locatie, centroid in zip(
+            locaties, to_wgs84(loc.geometrie for loc in locaties)):
+        locatie.centroid = centroid
@@ -17,10 +17,13 @@ _index = es.Index(settings.ELASTIC_INDEX)
 class Term(es.DocType):
     term = es.Text()
     gewicht = es.Integer()
+    # Typeahead, weighted by gewicht
+    suggest = es.Completion()
 
 
 @_index.doc_type
 class Organisatie(es.DocType):
+    guid = es.String(index='not_analyzed')  # tiebreaker for paging
     ext_id = es.String(index='not_analyzed')
     naam = es.String(analyzer=dutch_analyzer)  # ngram
     beschrijving = es.String(analyzer=dutch_analyzer)
@@ -29,6 +32,7 @@ class Organisatie(es.DocType):
 
 @_index.doc_type
 class Locatie(es.DocType):
+    guid = es.String(index='not_analyzed')  # tiebreaker for paging
     ext_id = es.String(index='not_analyzed')
     naam = es.String(analyzer=dutch_analyzer)
     centroid = es.GeoPoint()
@@ -40,6 +44,7 @@ class Locatie(es.DocType):
 
 @_index.doc_type
 class Activiteit(es.DocType):
+    guid = es.String(index='not_analyzed')  # tiebreaker for paging
     ext_id = es.String(index='not_analyzed')
     naam = es.String(analyzer=dutch_analyzer)
     beschrijving = es.String(analyzer=dutch_analyzer)
@@ -59,3 +64,69 @@ class Activiteit(es.DocType):
             'postcode': es.String(index='not_analyzed')
         }
     )
+
+
+def centroid(point):
+    """lon/lat of a WGS84 point, or None."""
+    if point is None:
+        return None
+    return {'lon': point.x, 'lat': point.y}
+
+
+def from_locatie(locatie) -> Locatie:
+    return Locatie(
+        meta={'id': locatie.guid},
+        guid=locatie.guid,
+        ext_id=locatie.id,
+        naam=locatie.naam,
+        centroid=centroid(locatie.centroid),
+        openbare_ruimte_naam=locatie.openbare_ruimte_naam,
+        huisnummer=locatie.huisnummer,
+        huisnummer_toevoeging=locatie.huisnummer_toevoeging,
+        postcode=locatie.postcode,
+    )
+
+
+def from_organisatie(organisatie) -> Organisatie:
+    return Organisatie(
+        meta={'id': organisatie.guid},
+        guid=organisatie.guid,
+        ext_id=organisatie.id,
+        naam=organisatie.naam,
+        beschrijving=organisatie.beschrijving,
+        afdeling=organisatie.afdeling,
+    )
+
+
+def from_activiteit(activiteit) -> Activiteit:
+    """Activiteit document, embedding its locatie.
+
+    Expects ``locatie`` to be selected and ``tags`` to be prefetched,
+    otherwise every call costs extra queries.
+    """
+    doc = Activiteit(
+        meta={'id': activiteit.guid},
+        guid=activiteit.guid,
+        ext_id=activiteit.id,
+        naam=activiteit.naam,
+        beschrijving=activiteit.beschrijving,
+        bron_link=activiteit.bron_link,
+        tijdstip=activiteit.start_time and activiteit.start_time.isoformat(),
+        tags=[tag.naam for tag in activiteit.tags.all()],
+    )
+    if activiteit.locatie is not None:
+        locatie = from_locatie(activiteit.locatie)
+        doc.locatie = locatie.to_dict()
+        doc.centroid = locatie.centroid
+    return doc
+
+
+def from_term(term: str, gewicht: int) -> Term:
+    # Every word starts an input, so 'yoga' suggests 'hatha yoga' as well
+    words = term.split()
+    return Term(
+        meta={'id': term}, term=term, gewicht=gewicht,
+        suggest={
+            'input': [' '.join(words[i:]) for i in range(len(words))],
+            'weight': gewicht,
+        })
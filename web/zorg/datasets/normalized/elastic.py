@@ -1,9 +1,15 @@
+import contextlib
 import functools
 import json
 import logging
+import math
+import threading
+import time
 
 from django.conf import settings
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, TransportError
+from elasticsearch.serializer import JSONSerializer
+from elasticsearch_dsl.connections import connections
 
 _logger = logging.getLogger(__name__)
 
@@ -13,101 +19,245 @@ class SearchError(Exception):
     wrong while searching."""
 
 
-@functools.lru_cache(maxsize=1)
-def _elasticsearch():
-    """Elasticsearch Instance.
+class CircuitOpen(SearchError):
+    """Elastic failed too often lately, so we don't ask it for now."""
+
+
+# Statuses of an overloaded or unreachable cluster; other errors, like a bad
+# query, say nothing about its health. elasticsearch-py has 'N/A' for
+# connection errors and timeouts.
+OVERLOADED = {'N/A', 429, 502, 503, 504}
+
+
+class CircuitBreaker:
+    """Fails fast after `failures` overload errors in a row.
+
+    Once open, calls raise CircuitOpen for `reset` seconds. After that one
+    call at a time is let through; the circuit closes when one succeeds.
+    """
+
+    def __init__(self, failures, reset):
+        self.failures = failures
+        self.reset = reset
+        self._count = 0
+        self._opened = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened is not None and \
+            time.monotonic() - self._opened < self.reset
+
+    def check(self):
+        """Raise CircuitOpen, unless a call may be made."""
+        with self._lock:
+            if self._opened is None:
+                return
+            now = time.monotonic()
+            if now - self._opened < self.reset:
+                raise CircuitOpen()
+            # Half open: this call is the trial, the others keep failing fast
+            self._opened = now
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self._count = 0
+                self._opened = None
+                return
+            self._count += 1
+            if self._count >= self.failures:
+                if self._opened is None:
+                    _logger.error('Elastic circuit opened')
+                self._opened = time.monotonic()
+
+    @contextlib.contextmanager
+    def guard(self):
+        """Count the outcome of the Elastic call in the block."""
+        self.check()
+        try:
+            yield
+        except TransportError as e:
+            self.record(e.status_code not in OVERLOADED)
+            raise
+        self.record(True)
 
-    lru_cache makes this a singleton. I think / hope we don't need to worry
-    about the connection. The docs indicate that the Elasticsearch library
-    takes care of this itself.
 
-    :see: https://elasticsearch-py.readthedocs.io/en/master/#persistent-connections
+breaker = CircuitBreaker(
+    settings.ELASTIC_CIRCUIT_FAILURES, settings.ELASTIC_CIRCUIT_RESET)
+
+
+def _client(sniff=True, **options):
+    """Elasticsearch instance configured from the settings.
+
+    Keeps up to ELASTIC_MAXSIZE keep-alive connections per node. With more
+    than one host in ELASTIC_SEARCH_HOSTS the nodes of the cluster are
+    sniffed, at start and whenever a connection fails, unless `sniff` is
+    false.
     """
+    sniff = sniff and settings.ELASTIC_SNIFF and \
+        len(settings.ELASTIC_SEARCH_HOSTS) > 1
     return Elasticsearch(
-        hosts=settings.ELASTIC_SEARCH_HOSTS, retry_on_timeout=True,
-        refresh=True
+        hosts=settings.ELASTIC_SEARCH_HOSTS,
+        maxsize=settings.ELASTIC_MAXSIZE,
+        timeout=settings.ELASTIC_TIMEOUT,
+        retry_on_timeout=True,
+        sniff_on_start=sniff,
+        sniff_on_connection_fail=sniff,
+        sniffer_timeout=60 if sniff else None,
+        **options
     )
 
 
-def typeahead(q=''):
-    """Get a list of JSON encoded search suggestions based on the given query.
+@functools.lru_cache(maxsize=1)
+def _elasticsearch():
+    """The Elasticsearch instance, shared by every caller in the process.
+
+    lru_cache makes this a singleton. It's the default connection of
+    elasticsearch_dsl as well.
+    """
+    client = _client()
+    connections.add_connection('default', client)
+    return client
+
+
+class _RawSerializer(JSONSerializer):
+    """Serializes request bodies as usual, but hands back response bodies as
+    they came off the wire."""
+
+    def loads(self, s):
+        return s
+
+
+@functools.lru_cache(maxsize=1)
+def _raw_elasticsearch():
+    """Elasticsearch instance whose calls return the raw JSON response body.
+
+    For responses we pass on to the client untouched, so they don't need to
+    be parsed and encoded again. It doesn't sniff: the transport reads the
+    nodes from the deserialized response, which would be a string here.
+    """
+    return _client(
+        sniff=False, serializers={JSONSerializer.mimetype: _RawSerializer()})
+
+
+# Suggestions per typeahead request
+TYPEAHEAD_SIZE = 100
+
+
+def typeahead_query(q=''):
+    """Elastic completion suggest request for the given query.
+
+    The suggester looks `q` up in an in-memory FST of the Term suggest
+    inputs, best gewicht first. Terms match on every suffix of words, so
+    different terms share suggestion texts: `typeahead_suggestions`
+    dedupes on the term instead of the suggester.
 
     :param q: query
     """
-    query = {
-        'size': 100,
-        'query': {
-            'bool': {
-                'must': [
-                    {
-                        'type': {
-                            'value': 'term'
-                        }
-                    },
-                    {
-                        'prefix': {
-                            'term': q,
-                        }
-
-                    }
-
-                ]}
-
-        },
-        'sort': [
-            {
-                'gewicht': {
-                    'order': 'desc'
+    return {
+        '_source': ['term'],
+        'suggest': {
+            'term': {
+                'prefix': q,
+                'completion': {
+                    'field': 'suggest',
+                    'size': TYPEAHEAD_SIZE,
                 }
             }
-        ]
+        }
     }
+
+
+# Only the suggestion texts are transferred
+TYPEAHEAD_FILTER_PATH = ['suggest.term.options._source.term']
+
+
+def typeahead_suggestions(results):
+    """JSON encoded list of the suggestions in a typeahead response.
+
+    A term matching on more than one of its inputs is listed once.
+    """
+    suggestions = {}
+    for suggest in results.get('suggest', {}).get('term', []):
+        for option in suggest.get('options', []):
+            suggestions.setdefault(option['_source']['term'], None)
+    return json.dumps(list(suggestions))
+
+
+def typeahead(q=''):
+    """Get a list of JSON encoded search suggestions based on the given query.
+
+    :param q: query
+    """
     try:
-        results = _elasticsearch().search(
-            index=settings.ELASTIC_INDEX,
-            body=query
-        )
+        with breaker.guard():
+            results = _elasticsearch().search(
+                index=settings.ELASTIC_INDEX,
+                body=typeahead_query(q),
+                filter_path=TYPEAHEAD_FILTER_PATH,
+                request_timeout=settings.ELASTIC_SEARCH_TIMEOUT
+            )
+    except CircuitOpen:
+        raise
     except Exception as e:
         raise SearchError() from e
-    suggestions = []
-    for suggestion in results['hits']['hits']:
-        suggestions.append(suggestion['_source']['term'])
-    return json.dumps(suggestions)
+    return typeahead_suggestions(results)
 
 
-def query(q='', doctype=None, lonlat=None, tags=None):
-    """Generate and fire an Elastic query."""
-    query = {
-        'sort': '_score',
-        'size': '50',
-        'query': {
-            'function_score': {
-                'query': {
-                    'bool': {
-                        'must_not': [
-                            {'type': {'value': 'term'}}
-                        ]
-                    }
-                }
-            }
-        }
+# Meters per degree of latitude
+_METERS_PER_DEGREE = 111320
+
+
+def snap_lonlat(lonlat, grid):
+    """Snap `lonlat` to the center of its cell in a grid of about `grid`
+    meters.
+
+    Nearby origins end up the same, which makes geo searches cacheable. The
+    origin moves at most ``grid / sqrt(2)`` meters.
+    """
+    lon, lat = lonlat
+    lat_step = grid / _METERS_PER_DEGREE
+    lat = (math.floor(lat / lat_step) + 0.5) * lat_step
+    lon_step = lat_step / math.cos(math.radians(lat))
+    lon = (math.floor(lon / lon_step) + 0.5) * lon_step
+    return round(lon, 7), round(lat, 7)
+
+
+def query(q='', doctype=None, lonlat=None, tags=None, size=None, after=None):
+    """Generate and fire an Elastic query.
+
+    Only the text query and the distance take part in scoring. Doctype and
+    tags are filters: they don't score, and Elastic can cache them.
+
+    Pages are fetched with search_after: `after` is the ``sort`` value of the
+    last hit of the previous page. The guid breaks ties between equal
+    scores, so the order is stable and every page costs the same.
+    """
+    bools = {
+        'must_not': [
+            {'type': {'value': 'term'}}
+        ]
     }
-    bools = {}
     functions = []
 
     if q:
-        bools['should'] = {
+        bools['must'] = {
             'multi_match': {
                 'query': q, 'fields': ['naam^1.5', 'beschrijving']
             }
         }
+    else:
+        # Filters alone score 0, which would zero the distance function too
+        bools['must'] = {'match_all': {}}
 
-    if tags or doctype:
-        bools['must'] = []
-        if doctype:
-            bools['must'].append({'type': {'value': doctype}})
-        if tags:
-            bools['must'].extend({'term': {'tags': tag}} for tag in tags)
+    filters = []
+    if doctype:
+        filters.append({'type': {'value': doctype}})
+    if tags:
+        filters.extend({'term': {'tags': tag}} for tag in tags)
+    if filters:
+        bools['filter'] = filters
 
     if lonlat:
         lon, lat = lonlat
@@ -122,21 +272,135 @@ def query(q='', doctype=None, lonlat=None, tags=None):
             }
         })
 
-    if bools:
-        query['query']['function_score']['query']['bool'].update(bools)
+    query = {
+        # Indices from before the guid field was mapped can't sort on it
+        'sort': [
+            {'_score': 'desc'},
+            {'guid': {'order': 'asc', 'unmapped_type': 'keyword'}}],
+        'size': size or settings.SEARCH_PAGE_SIZE,
+        'query': {
+            'function_score': {
+                'query': {'bool': bools}
+            }
+        }
+    }
     if functions:
         query['query']['function_score']['functions'] = functions
 
+    if after:
+        query['search_after'] = after
+
     return query
 
 
-def search(q='', doctype=None, lonlat=None, tags=None):
+# The compact profile: guid (_id) and type (_type) come with every hit, plus
+# these fields and a snippet of the beschrijving
+COMPACT_SOURCE = ['naam', 'centroid']
+SNIPPET = {
+    'fields': {
+        'beschrijving': {
+            'fragment_size': 150,
+            'number_of_fragments': 1,
+            # The start of the text if the query doesn't match it
+            'no_match_size': 150,
+            'pre_tags': [''],
+            'post_tags': [''],
+        }
+    }
+}
+
+
+# Facets: the most frequent tags, and the number of hits per doctype and,
+# for geo searches, per range of distances in meters
+FACET_SIZE = 100
+FACET_DISTANCES = (500, 1000, 2500, 5000)
+
+
+def distance_ranges():
+    """The ranges of the distance facet, unbounded at both ends."""
+    bounds = (None,) + FACET_DISTANCES + (None,)
+    ranges = []
+    for start, end in zip(bounds, bounds[1:]):
+        bucket = {}
+        if start is not None:
+            bucket['from'] = start
+        if end is not None:
+            bucket['to'] = end
+        ranges.append(bucket)
+    return ranges
+
+
+def facet_aggs(lonlat=None):
+    """Aggregations that count the hits per tag, doctype and distance."""
+    aggs = {
+        'tags': {'terms': {'field': 'tags', 'size': FACET_SIZE}},
+        'doctype': {'terms': {'field': '_type'}},
+    }
+    if lonlat:
+        lon, lat = lonlat
+        aggs['distance'] = {
+            'geo_distance': {
+                'field': 'centroid',
+                'origin': {'lon': lon, 'lat': lat},
+                'unit': 'm',
+                'ranges': distance_ranges(),
+            }
+        }
+    return aggs
+
+
+def search_request(q='', doctype=None, lonlat=None, tags=None, fields=None,
+                   compact=False, size=None, after=None, facets=False):
+    """Body and filter_path of a search request.
+
+    Only the parts of the response listed in ELASTIC_SEARCH_FILTER_PATH are
+    transferred. Of the hits' _source only `fields` are, or the compact
+    profile fields, or those in ELASTIC_SEARCH_SOURCE. With `facets` the
+    response has the buckets of the facet aggregations, computed in the same
+    request.
+    """
+    body = query(q, doctype, lonlat, tags, size, after)
+    filter_path = settings.ELASTIC_SEARCH_FILTER_PATH
+    source = fields or (COMPACT_SOURCE if compact else settings.ELASTIC_SEARCH_SOURCE)
+    if source:
+        body['_source'] = source
+    if compact:
+        body['highlight'] = SNIPPET
+        filter_path = filter_path + ['hits.hits.highlight']
+    if facets:
+        body['aggs'] = facet_aggs(lonlat)
+        filter_path = filter_path + ['aggregations.*.buckets']
+    return body, filter_path
+
+
+def with_hits(body):
+    """`body` of a search response, with a hits list even when empty.
+
+    filter_path leaves out ``hits.hits`` when nothing matched. Only then is
+    the (small) response decoded.
+    """
+    if '"hits":[' in body:
+        return body
+    results = json.loads(body)
+    results.setdefault('hits', {}).setdefault('hits', [])
+    return json.dumps(results)
+
+
+def search(**params):
+    """JSON encoded search results, as returned by Elastic.
+
+    Takes the arguments of :func:`search_request`.
+    """
+    body, filter_path = search_request(**params)
     try:
-        response = _elasticsearch().search(
-            index=settings.ELASTIC_INDEX,
-            body=query(q, doctype, lonlat, tags)
-        )
+        with breaker.guard():
+            return with_hits(_raw_elasticsearch().search(
+                index=settings.ELASTIC_INDEX,
+                body=body,
+                filter_path=filter_path,
+                request_timeout=settings.ELASTIC_SEARCH_TIMEOUT
+            ))
+    except CircuitOpen:
+        raise
     except Exception as e:
         raise SearchError() from e
-
-    return json.dumps(response)
@@ -0,0 +1,178 @@
+"""Streaming full-dataset exports as NDJSON or CSV.
+
+Rows are read in keyset batches on the guid with ``values()``, so no model
+instances or DRF serializers are built, and memory use doesn't grow with the
+size of the dataset. Activiteiten are joined to their locatie and organisatie
+in the same query, their tags cost one extra query per batch.
+"""
+import csv
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.views.decorators.http import condition, require_GET
+
+from . import models, versions
+
+LOCATIE_FIELDS = (
+    'guid', 'id', 'naam', 'openbare_ruimte_naam', 'postcode', 'huisnummer',
+    'huisletter', 'huisnummer_toevoeging', 'bag_link', 'geometrie', 'centroid',
+)
+ORGANISATIE_FIELDS = (
+    'guid', 'id', 'naam', 'beschrijving', 'afdeling', 'contact', 'locatie_id',
+)
+ACTIVITEIT_FIELDS = (
+    'guid', 'id', 'naam', 'beschrijving', 'bron_link', 'contactpersoon',
+    'start_time', 'end_time',
+)
+
+
+class Export:
+    """Rows of one collection, plus the collections they are built from."""
+
+    def __init__(self, model, fields, collections, related=None, tags=False):
+        self.model = model
+        self.fields = fields
+        self.collections = collections
+        self.related = related or {}
+        self.tags = tags
+
+    def columns(self):
+        columns = list(self.fields)
+        for name, fields in self.related.items():
+            columns.extend(f'{name}.{field}' for field in fields)
+        if self.tags:
+            columns.append('tags')
+        return columns
+
+    def batches(self, size):
+        values = list(self.fields) + [
+            f'{name}__{field}' for name, fields in self.related.items()
+            for field in fields]
+        queryset = self.model.objects.order_by('guid').values(*values)
+        last = None
+        while True:
+            page = queryset if last is None else queryset.filter(guid__gt=last)
+            batch = [self.row(values) for values in page[:size]]
+            if not batch:
+                return
+            last = batch[-1]['guid']
+            yield self.add_tags(batch)
+
+    def row(self, values):
+        row = {field: _plain(values[field]) for field in self.fields}
+        for name, fields in self.related.items():
+            related = {
+                field: _plain(values[f'{name}__{field}']) for field in fields}
+            row[name] = related if related['guid'] is not None else None
+        return row
+
+    def add_tags(self, batch):
+        if not self.tags:
+            return batch
+        tags = {row['guid']: [] for row in batch}
+        for guid, naam in models.Activiteit.tags.through.objects.filter(
+                activiteit_id__in=tags).values_list(
+                    'activiteit_id', 'tagdefinition__naam'):
+            tags[guid].append(naam)
+        for row in batch:
+            row['tags'] = sorted(tags[row['guid']])
+        return batch
+
+
+EXPORTS = {
+    'activiteit': Export(
+        models.Activiteit, ACTIVITEIT_FIELDS,
+        ('activiteit', 'locatie', 'organisatie', 'tags'),
+        related={
+            'locatie': LOCATIE_FIELDS,
+            'organisatie': ('guid', 'id', 'naam', 'afdeling'),
+        },
+        tags=True),
+    'locatie': Export(models.Locatie, LOCATIE_FIELDS, ('locatie',)),
+    'organisatie': Export(
+        models.Organisatie, ORGANISATIE_FIELDS, ('organisatie',)),
+}
+
+
+def _plain(value):
+    """JSON/CSV friendly value, geometries become EWKT."""
+    return value.ewkt if hasattr(value, 'ewkt') else value
+
+
+def _ndjson(batches):
+    encoder = DjangoJSONEncoder()
+    for batch in batches:
+        yield ''.join(encoder.encode(row) + '\n' for row in batch)
+
+
+class _Lines:
+    """File-like object that hands back what the csv writer writes."""
+
+    def write(self, value):
+        return value
+
+
+def _csv(batches, columns):
+    writer = csv.writer(_Lines())
+    yield writer.writerow(columns)
+    for batch in batches:
+        yield ''.join(
+            writer.writerow(_csv_values(row, columns)) for row in batch)
+
+
+def _csv_values(row, columns):
+    values = []
+    for column in columns:
+        name, _, field = column.partition('.')
+        value = row[name]
+        if field:
+            value = value and value[field]
+        if isinstance(value, list):
+            value = ';'.join(value)
+        elif isinstance(value, dict):
+            value = json.dumps(value, cls=DjangoJSONEncoder)
+        values.append('' if value is None else value)
+    return values
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _last_modified(request, doctype, fmt):
+    return versions.last_modified(*EXPORTS[doctype].collections)
+
+
+@require_GET
+@condition(last_modified_func=_last_modified)
+def export(request, doctype, fmt):
+    """Stream the complete `doctype` collection.
+
+    Answers conditional GETs with 304 when nothing changed since
+    If-Modified-Since, and gzips the stream when the client accepts it.
+    """
+    exporter = EXPORTS[doctype]
+    batches = exporter.batches(settings.EXPORT_BATCH_SIZE)
+    if fmt == 'csv':
+        chunks = _csv(batches, exporter.columns())
+        content_type = 'text/csv; charset=utf-8'
+    else:
+        chunks = _ndjson(batches)
+        content_type = 'application/x-ndjson'
+
+    gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    response = StreamingHttpResponse(
+        _gzip(chunks) if gzip else chunks, content_type=content_type)
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    response['Vary'] = 'Accept-Encoding'
+    response['Content-Disposition'] = f'attachment; filename="{doctype}.{fmt}"'
+    return response
@@ -0,0 +1,393 @@
+"""Bulk import of organisaties, locaties and activiteiten from files.
+
+Records are read incrementally, from the sheets of an xlsx workbook (in
+read-only mode) or from JSON arrays. They are checked and mapped to guids
+of the owning profile in Python, and then streamed into temporary staging
+tables with ``COPY``, one chunk at a time. Merging them into the
+``normalized_*`` tables is set-based: one ``INSERT ... ON CONFLICT`` per
+table, and one replace of the tags of the imported activiteiten.
+
+Everything happens in the caller's transaction. Rolling that back after
+:meth:`Importer.diff` gives a dry run.
+"""
+import csv
+import io
+import json
+
+import openpyxl
+from django.contrib.gis.geos import GEOSException, GEOSGeometry
+from django.db import connection
+from django.utils.dateparse import parse_datetime
+
+from . import coordinates, models
+
+MODELS = {
+    'organisatie': models.Organisatie,
+    'locatie': models.Locatie,
+    'activiteit': models.Activiteit,
+}
+# Columns written by the import, in the order in which tables are merged
+FIELDS = {
+    'organisatie': (
+        'guid', 'id', 'naam', 'beschrijving', 'afdeling', 'contact'),
+    'locatie': (
+        'guid', 'id', 'naam', 'openbare_ruimte_naam', 'postcode',
+        'huisnummer', 'huisletter', 'huisnummer_toevoeging', 'bag_link',
+        'geometrie', 'centroid'),
+    'activiteit': (
+        'guid', 'id', 'naam', 'beschrijving', 'bron_link', 'contactpersoon',
+        'start_time', 'end_time', 'locatie_id', 'organisatie_id'),
+}
+_GEOMETRIES = ('geometrie', 'centroid')
+_DATETIMES = ('start_time', 'end_time')
+_NULLABLE = _GEOMETRIES + _DATETIMES + ('locatie_id', 'organisatie_id')
+
+# Spreadsheet columns named differently from the fields
+COLUMNS = {'straatnaam': 'openbare_ruimte_naam', 'labels': 'tags'}
+# Spreadsheet columns that make up the contact of an organisatie
+CONTACT = {'telefoonnummer': 'tel', 'email': 'email', 'website': 'www'}
+
+_TAGS = models.Activiteit.tags.through._meta.db_table
+_TAG_DEFINITIONS = models.TagDefinition._meta.db_table
+_NULL = '\\N'
+
+
+class RecordError(Exception):
+    pass
+
+
+def read_xlsx(path):
+    """(doctype, records) per sheet named after a doctype."""
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            doctype = sheet.title.strip().lower()
+            if doctype not in FIELDS:
+                continue
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, ())
+            header = [
+                COLUMNS.get(name, name) for name in
+                (str(cell or '').strip().lower() for cell in header)]
+            yield doctype, (
+                dict(zip(header, row)) for row in rows
+                if any(cell not in (None, '') for cell in row))
+    finally:
+        workbook.close()
+
+
+def read_json(file, size=1 << 16):
+    """The elements of the JSON array in `file`, without loading all of it."""
+    decoder = json.JSONDecoder()
+    buffer, pos, started = '', 0, False
+    for chunk in iter(lambda: file.read(size), ''):
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('Expected a JSON array')
+                started, pos = True, pos + 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # Incomplete, read on
+            yield record
+    raise ValueError('Invalid or incomplete JSON array')
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Spreadsheets turn ids into numbers
+        value = int(value)
+    return str(value).strip()
+
+
+def _geometrie(value):
+    """RD point of an (E)WKT value, points without SRID are RD already."""
+    if not value:
+        return None
+    try:
+        point = GEOSGeometry(value)
+    except (ValueError, GEOSException):
+        raise RecordError(f'Invalid geometrie {value!r}')
+    if point.srid is None:
+        point.srid = coordinates.RD
+    elif point.srid != coordinates.RD:
+        point.transform(coordinates.RD)
+    return point
+
+
+def _datetime(value):
+    if value in (None, ''):
+        return None
+    if not hasattr(value, 'isoformat'):
+        parsed = parse_datetime(str(value))
+        if parsed is None:
+            raise RecordError(f'Invalid datetime {value!r}')
+        value = parsed
+    return value.isoformat()
+
+
+class Importer:
+    """Stages records for one profile and merges them."""
+
+    def __init__(self, profile, chunk_size=5000):
+        self.prefix = profile.guid
+        self.profiles = set(
+            models.Profile.objects.values_list('guid', flat=True))
+        self.chunk_size = chunk_size
+        self.staged = dict.fromkeys(FIELDS, 0)
+        self.errors = []
+        self._created = False
+
+    def _create_tables(self):
+        with connection.cursor() as cursor:
+            # Left over by an earlier import in the same transaction
+            cursor.execute(
+                'DROP TABLE IF EXISTS import_tags, ' + ', '.join(
+                    f'import_{doctype}' for doctype in MODELS))
+            for doctype, model in MODELS.items():
+                cursor.execute(
+                    f'CREATE TEMP TABLE import_{doctype} '
+                    f'(LIKE {model._meta.db_table}, ordinal serial) '
+                    f'ON COMMIT DROP')
+                # Set by the merge
+                cursor.execute(
+                    f'ALTER TABLE import_{doctype} '
+                    f'ALTER COLUMN updated_at DROP NOT NULL')
+            cursor.execute(
+                'CREATE TEMP TABLE import_tags '
+                '(activiteit_id varchar(255), naam varchar(255)) '
+                'ON COMMIT DROP')
+        self._created = True
+
+    def guid(self, ext_id):
+        return f'{self.prefix}-{ext_id}'
+
+    def row(self, doctype, record):
+        """Column values of `record`, and its tags."""
+        if not isinstance(record, dict):
+            raise RecordError('Not an object')
+        ext_id = _text(record.get('id'))
+        if not ext_id:
+            raise RecordError('Missing id')
+        row = {
+            field: _text(record.get(field)) for field in FIELDS[doctype]
+            if field not in _NULLABLE}
+        row['id'] = ext_id
+        tags = []
+        if doctype == 'organisatie':
+            # One organisatie per profile
+            row['guid'] = self.prefix
+            contact = record.get('contact') or {
+                key: _text(record[column]) for column, key in CONTACT.items()
+                if record.get(column) not in (None, '')}
+            row['contact'] = json.dumps(contact)
+        elif doctype == 'locatie':
+            row['guid'] = self.guid(ext_id)
+            row['geometrie'] = _geometrie(_text(record.get('geometrie')))
+        else:
+            row['guid'] = self.guid(ext_id)
+            for field in _DATETIMES:
+                row[field] = _datetime(record.get(field))
+            locatie = _text(record.get('locatie_id'))
+            row['locatie_id'] = locatie and self.guid(locatie) or None
+            organisatie = _text(record.get('organisatie_id'))
+            row['organisatie_id'] = organisatie and (
+                organisatie if organisatie in self.profiles else self.prefix
+            ) or None
+            tags = record.get('tags') or []
+            if isinstance(tags, str):
+                tags = tags.split(',')
+            tags = sorted({_text(tag) for tag in tags} - {''})
+        if not row['naam']:
+            raise RecordError('Missing naam')
+        return row, tags
+
+    def stage(self, doctype, records):
+        """COPY `records` into the staging table of `doctype`, a chunk at a
+        time. Records that can't be imported are added to `errors`."""
+        if not self._created:
+            self._create_tables()
+        chunk = []
+        for index, record in enumerate(records):
+            try:
+                chunk.append(self.row(doctype, record))
+            except RecordError as e:
+                self.errors.append((doctype, index, str(e)))
+            if len(chunk) >= self.chunk_size:
+                self._copy(doctype, chunk)
+                chunk = []
+        if chunk:
+            self._copy(doctype, chunk)
+
+    def _copy(self, doctype, chunk):
+        if doctype == 'locatie':
+            # One PROJ call for the whole chunk
+            centroids = coordinates.to_wgs84(row['geometrie'] for row, _ in chunk)
+            for (row, _), centroid in zip(chunk, centroids):
+                row['centroid'] = centroid
+        fields = FIELDS[doctype]
+        rows, tags = io.StringIO(), io.StringIO()
+        writer, tag_writer = csv.writer(rows), csv.writer(tags)
+        for row, names in chunk:
+            writer.writerow([_csv_value(row[field]) for field in fields])
+            tag_writer.writerows((row['guid'], naam) for naam in names)
+        with connection.cursor() as cursor:
+            rows.seek(0)
+            cursor.copy_expert(
+                f"COPY import_{doctype} ({', '.join(fields)}) FROM STDIN "
+                f"WITH (FORMAT csv, NULL '{_NULL}')", rows)
+            if doctype == 'activiteit':
+                tags.seek(0)
+                cursor.copy_expert(
+                    'COPY import_tags (activiteit_id, naam) FROM STDIN '
+                    'WITH (FORMAT csv)', tags)
+        self.staged[doctype] += len(chunk)
+
+    def check(self):
+        """Drop staged activiteiten with unknown relations, and unknown tags.
+
+        Runs in SQL, against the staged and the existing rows.
+        """
+        checks = (
+            ('locatie_id', 'locatie', 'Locatie'),
+            ('organisatie_id', 'organisatie', 'Organisatie'),
+        )
+        with connection.cursor() as cursor:
+            for column, doctype, label in checks:
+                target = MODELS[doctype]._meta.db_table
+                cursor.execute(f'''
+                    DELETE FROM import_activiteit a
+                    WHERE a.{column} IS NOT NULL
+                      AND NOT EXISTS (
+                        SELECT 1 FROM import_{doctype} s WHERE s.guid = a.{column})
+                      AND NOT EXISTS (
+                        SELECT 1 FROM {target} t WHERE t.guid = a.{column})
+                    RETURNING a.guid, a.{column}''')
+                for guid, related in cursor.fetchall():
+                    self.errors.append(
+                        ('activiteit', guid, f'{label} {related} does not exist'))
+            cursor.execute(f'''
+                DELETE FROM import_tags i
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {_TAG_DEFINITIONS} d WHERE d.naam = i.naam)
+                RETURNING i.activiteit_id, i.naam''')
+            for guid, naam in cursor.fetchall():
+                self.errors.append(('activiteit', guid, f'Unknown tag {naam}'))
+
+    @staticmethod
+    def _latest(doctype):
+        """The staged rows, the last one per guid."""
+        return (f'(SELECT DISTINCT ON (guid) * FROM import_{doctype} '
+                f'ORDER BY guid, ordinal DESC)')
+
+    @staticmethod
+    def _distinct(doctype, left, right):
+        """SQL that is true when row `left` differs from row `right`."""
+        def columns(alias):
+            return ', '.join(
+                f'ST_AsEWKB({alias}.{field})' if field in _GEOMETRIES
+                else f'{alias}.{field}'
+                for field in FIELDS[doctype] if field != 'guid')
+        return f'ROW({columns(left)}) IS DISTINCT FROM ROW({columns(right)})'
+
+    def _retagged(self, cursor):
+        """Guids of staged activiteiten whose tags change."""
+        cursor.execute(f'''
+            SELECT a.guid FROM import_activiteit a
+            WHERE ARRAY(
+                SELECT DISTINCT naam FROM import_tags i
+                WHERE i.activiteit_id = a.guid ORDER BY naam
+            ) IS DISTINCT FROM ARRAY(
+                SELECT d.naam FROM {_TAGS} t
+                JOIN {_TAG_DEFINITIONS} d ON d.id = t.tagdefinition_id
+                WHERE t.activiteit_id = a.guid ORDER BY d.naam
+            )''')
+        return {guid for guid, in cursor.fetchall()}
+
+    def diff(self, examples=10):
+        """What merging would do: per doctype the number of new, changed and
+        unchanged rows, with some of their guids."""
+        report = {}
+        with connection.cursor() as cursor:
+            for doctype, model in MODELS.items():
+                cursor.execute(f'''
+                    SELECT s.guid, CASE
+                        WHEN t.guid IS NULL THEN 'new'
+                        WHEN {self._distinct(doctype, 's', 't')} THEN 'changed'
+                        ELSE 'unchanged' END
+                    FROM {self._latest(doctype)} s
+                    LEFT JOIN {model._meta.db_table} t ON t.guid = s.guid
+                    ORDER BY s.guid''')
+                changes = {'new': [], 'changed': [], 'unchanged': []}
+                for guid, change in cursor.fetchall():
+                    changes[change].append(guid)
+                report[doctype] = {
+                    change: {'count': len(guids), 'examples': guids[:examples]}
+                    for change, guids in changes.items()}
+            retagged = sorted(self._retagged(cursor))
+            report['tags'] = {'changed': {
+                'count': len(retagged), 'examples': retagged[:examples]}}
+        return report
+
+    def merge(self):
+        """Upsert the staged rows and replace the tags of the staged
+        activiteiten. Returns the changed guids per doctype and the counts.
+        """
+        changed, result = {}, {}
+        with connection.cursor() as cursor:
+            retagged = self._retagged(cursor)
+            for doctype, model in MODELS.items():
+                table = model._meta.db_table
+                fields = ', '.join(FIELDS[doctype])
+                updates = ', '.join(
+                    f'{field} = EXCLUDED.{field}'
+                    for field in FIELDS[doctype] if field != 'guid')
+                cursor.execute(f'''
+                    INSERT INTO {table} AS t ({fields}, updated_at)
+                    SELECT {fields}, now() FROM {self._latest(doctype)} s
+                    ON CONFLICT (guid) DO UPDATE SET {updates}, updated_at = now()
+                    WHERE {self._distinct(doctype, 't', 'EXCLUDED')}
+                    RETURNING t.guid, xmax = 0''')
+                rows = cursor.fetchall()
+                added = sum(1 for _, inserted in rows if inserted)
+                changed[doctype] = {guid for guid, _ in rows}
+                cursor.execute(f'SELECT count(DISTINCT guid) FROM import_{doctype}')
+                total, = cursor.fetchone()
+                result[doctype] = {
+                    'added': added, 'updated': len(rows) - added,
+                    'unchanged': total - len(rows)}
+
+            cursor.execute(f'''
+                DELETE FROM {_TAGS}
+                WHERE activiteit_id IN (SELECT guid FROM import_activiteit)''')
+            cursor.execute(f'''
+                INSERT INTO {_TAGS} (activiteit_id, tagdefinition_id)
+                SELECT DISTINCT i.activiteit_id, d.id FROM import_tags i
+                JOIN {_TAG_DEFINITIONS} d ON d.naam = i.naam
+                WHERE i.activiteit_id IN (SELECT guid FROM import_activiteit)''')
+            cursor.execute(
+                f'UPDATE {MODELS["activiteit"]._meta.db_table} '
+                f'SET updated_at = now() WHERE guid = ANY(%s)', [list(retagged)])
+        changed['activiteit'] |= retagged
+        result['tags'] = {'changed': len(retagged)}
+        return changed, result
+
+
+def _csv_value(value):
+    if value is None:
+        return _NULL
+    if hasattr(value, 'ewkt'):
+        return value.ewkt
+    return value
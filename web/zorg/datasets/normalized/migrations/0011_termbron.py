@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.13 on 2026-10-18 11:40
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('normalized', '0010_batchjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TermBron',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doctype', models.CharField(max_length=20)),
+                ('guid', models.CharField(max_length=255)),
+                ('tokens', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), size=None)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='termbron',
+            unique_together={('doctype', 'guid')},
+        ),
+        migrations.AddIndex(
+            model_name='termbron',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tokens'], name='normalized_termbron_tokens'),
+        ),
+    ]
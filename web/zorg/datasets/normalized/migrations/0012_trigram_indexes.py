@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.13 on 2026-10-18 13:05
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('normalized', '0011_termbron'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='locatie',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['naam'], name='normalized_loc_naam_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='organisatie',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['naam'], name='normalized_org_naam_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='organisatie',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['beschrijving'], name='normalized_org_beschr_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='activiteit',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['naam'], name='normalized_act_naam_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='activiteit',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['beschrijving'], name='normalized_act_beschr_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
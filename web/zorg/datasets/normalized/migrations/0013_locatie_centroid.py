@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.13 on 2026-10-18 14:20
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('normalized', '0012_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locatie',
+            name='centroid',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, editable=False, null=True, srid=4326),
+        ),
+        migrations.RunSQL(
+            'UPDATE normalized_locatie SET centroid = ST_Transform(geometrie, 4326) '
+            'WHERE geometrie IS NOT NULL',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,8 +1,11 @@
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models as geo
-from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 
+from . import coordinates
+
 class TagDefinition(models.Model):
     """
     Predefined tags each with a category to eventually separate them in
@@ -17,6 +20,7 @@ class TagDefinition(models.Model):
 
     naam = models.CharField(max_length=255, unique=True)
     category = models.CharField(max_length=25, choices=CATEGORIES)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.naam
@@ -66,9 +70,19 @@ class Locatie(models.Model):
     huisnummer_toevoeging = models.CharField(max_length=32, blank=True)
     bag_link = models.URLField(blank=True)
     geometrie = geo.PointField(null=True, srid=28992, blank=True)
+    # WGS84 version of geometrie, kept up to date on save
+    centroid = geo.PointField(null=True, srid=4326, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     objects = geo.GeoManager()
 
+    def save(self, *args, **kwargs):
+        coordinates.set_centroids([self])
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'geometrie' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'centroid'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f'<{self.naam}>'
 
@@ -77,6 +91,11 @@ class Locatie(models.Model):
 
     class Meta:
         verbose_name_plural = "Locaties"
+        indexes = [
+            # Trigram indexes for the PostGIS search fallback
+            GinIndex(fields=['naam'], name='normalized_loc_naam_trgm',
+                     opclasses=['gin_trgm_ops']),
+        ]
 
 
 class Organisatie(models.Model):
@@ -88,6 +107,7 @@ class Organisatie(models.Model):
     afdeling = models.CharField(max_length=255, blank=True)
     contact = JSONField()  # for tele, fax, emai, www etc.
     locatie = models.ForeignKey(Locatie, related_name='locatie', blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f'<{self.naam}>'
@@ -97,6 +117,12 @@ class Organisatie(models.Model):
 
     class Meta:
         verbose_name_plural = "Organisaties"
+        indexes = [
+            GinIndex(fields=['naam'], name='normalized_org_naam_trgm',
+                     opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['beschrijving'], name='normalized_org_beschr_trgm',
+                     opclasses=['gin_trgm_ops']),
+        ]
 
 
 class Activiteit(models.Model):
@@ -114,6 +140,8 @@ class Activiteit(models.Model):
     end_time = models.DateTimeField(null=True)
     locatie = models.ForeignKey(Locatie, related_name='activiteiten', blank=True, null=True)
     organisatie = models.ForeignKey(Organisatie, related_name='activiteiten', blank=True, null=True)
+    # Also set when the tags change
+    updated_at = models.DateTimeField(auto_now=True)
 
     @property
     def contact(self):
@@ -136,3 +164,50 @@ class Activiteit(models.Model):
 
     class Meta:
         verbose_name_plural = "Activiteiten"
+        indexes = [
+            GinIndex(fields=['naam'], name='normalized_act_naam_trgm',
+                     opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['beschrijving'], name='normalized_act_beschr_trgm',
+                     opclasses=['gin_trgm_ops']),
+        ]
+
+
+class BatchJob(models.Model):
+    """
+    Processing state of a payload posted to /zorg/batch_update. The
+    records themselves travel with the RQ job.
+    """
+    STATUSES = (
+        ('queued', 'queued'),
+        ('running', 'running'),
+        ('success', 'success'),
+        ('failed', 'failed'),
+    )
+
+    auth_user = models.ForeignKey(User, on_delete=models.CASCADE)
+    guid = models.CharField(max_length=4)  # Profile.guid of the submitter
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    result = JSONField(default=dict)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f'<batch {self.pk} {self.status}>'
+
+
+class TermBron(models.Model):
+    """
+    Typeahead terms one activiteit, locatie or organisatie counts towards,
+    so the gewicht of terms can be updated without tokenizing everything.
+    """
+    doctype = models.CharField(max_length=20)
+    guid = models.CharField(max_length=255)
+    tokens = ArrayField(models.CharField(max_length=255))
+
+    def __str__(self):
+        return f'<{self.doctype} {self.guid}>'
+
+    class Meta:
+        unique_together = ('doctype', 'guid')
+        indexes = [GinIndex(fields=['tokens'], name='normalized_termbron_tokens')]
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework import pagination
+
+
+class GuidCursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination on the guid primary key. Every page is an index range
+    scan, no matter how deep into the collection, and no COUNT is done
+    unless asked for with ?count=true.
+    """
+    ordering = 'guid'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get('count') == 'true':
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data = OrderedDict(count=self.count, **response.data)
+        return response
+
+
+class ZorgPagination(pagination.BasePagination):
+    """
+    Page numbers by default, keyset pagination for requests that pass a
+    ?cursor= or ?pagination=cursor. The default for requests without either
+    is settings.ZORG_PAGINATION.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        mode = request.query_params.get('pagination', settings.ZORG_PAGINATION)
+        if 'cursor' in request.query_params or mode == 'cursor':
+            self.paginator = GuidCursorPagination()
+        else:
+            self.paginator = pagination.PageNumberPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    @property
+    def display_page_controls(self):
+        return self.paginator.display_page_controls
+
+    def to_html(self):
+        return self.paginator.to_html()
@@ -0,0 +1,318 @@
+"""Search on the database, for when Elastic is unavailable.
+
+Answers the same requests as :func:`elastic.search`, in the same response
+shape, with cruder ranking:
+
+- With a lon/lat the nearest locaties are read from the GiST index on
+  ``geometrie`` (KNN, ``<->``) in a CTE, and joined to the entities at those
+  locaties. The number of candidate locaties grows until a page is full, so
+  the nearest-N search never turns into a sequential scan. Hits are ranked
+  by distance only.
+- Otherwise hits are ranked by trigram word similarity of the query to the
+  naam (weighted like in Elastic) and beschrijving, matched on the trigram
+  GIN indexes.
+
+Totals are exact up to SEARCH_FALLBACK_MAX_TOTAL matches, so a search
+without conditions doesn't scan a whole table just to count it. Facets are
+counted with one query per facet and doctype, over all matches.
+
+Pages use the same search_after scheme, but the sort values are only valid
+for this engine: the first one is the negated distance in meters for geo
+searches.
+"""
+import json
+import time
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import connection
+
+from . import elastic, models, sync
+
+
+class _Table:
+    """An entity table and how it joins to the locatie with its geometrie."""
+
+    def __init__(self, model, locatie, text, tags=False):
+        self.name = model._meta.db_table
+        self.locatie = locatie
+        self.text = text
+        self.tags = tags
+
+
+_LOCATIE = models.Locatie._meta.db_table
+_TAGS = models.Activiteit.tags.through._meta.db_table
+_TAG_DEFINITIONS = models.TagDefinition._meta.db_table
+
+TABLES = {
+    'activiteit': _Table(
+        models.Activiteit, 'locatie_id', ('naam', 'beschrijving'), tags=True),
+    'locatie': _Table(models.Locatie, 'guid', ('naam',)),
+    'organisatie': _Table(
+        models.Organisatie, 'locatie_id', ('naam', 'beschrijving')),
+}
+
+# Weight of a match on naam, like the naam^1.5 of the Elastic query
+_NAAM_BOOST = 1.5
+
+
+def _filters(table, q, tags):
+    """SQL conditions on entity `e` and their parameters."""
+    conditions, params = [], {}
+    if q:
+        # <% is the word similarity operator of pg_trgm, it uses the GIN index
+        conditions.append('(' + ' OR '.join(
+            f'%(q)s <%% e.{column}' for column in table.text) + ')')
+        params['q'] = q
+    if tags:
+        conditions.append(f'''e.guid IN (
+            SELECT at.activiteit_id FROM {_TAGS} at
+            JOIN {_TAG_DEFINITIONS} t ON t.id = at.tagdefinition_id
+            WHERE t.naam = ANY(%(tags)s)
+            GROUP BY at.activiteit_id
+            HAVING count(DISTINCT t.naam) = %(tag_count)s)''')
+        params.update(tags=list(tags), tag_count=len(set(tags)))
+    return conditions, params
+
+
+def _score(table):
+    naam, *rest = table.text
+    scores = [f'word_similarity(%(q)s, e.{naam}) * {_NAAM_BOOST}'] + [
+        f'word_similarity(%(q)s, e.{column})' for column in rest]
+    return f'GREATEST({", ".join(scores)})' if rest else scores[0]
+
+
+def _fetch(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _total(table, conditions, params):
+    """Number of matches, counted up to SEARCH_FALLBACK_MAX_TOTAL.
+
+    Beyond that it's the planner's estimate of the rows in the table for
+    searches without conditions, and just the limit otherwise.
+    """
+    limit = settings.SEARCH_FALLBACK_MAX_TOTAL
+    total = _fetch(
+        f'SELECT count(*) FROM (SELECT 1 FROM {table.name} e WHERE '
+        f'{" AND ".join(conditions) or "TRUE"} LIMIT %(total_limit)s) m',
+        dict(params, total_limit=limit))[0][0]
+    if total == limit and not conditions:
+        estimate = _fetch(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [table.name])[0][0]
+        total = max(total, estimate)
+    return total
+
+
+def _ranked(table, q, tags, size, after):
+    """[(sort value, guid)] of the best `size` matches, and their total."""
+    conditions, params = _filters(table, q, tags)
+    where = ' AND '.join(conditions) or 'TRUE'
+    total = _total(table, conditions, params)
+    score = _score(table) if q else '1'
+    # Rounded, so the sort values survive the trip to the client and back
+    sql = f'''SELECT score, guid FROM (
+        SELECT round(({score})::numeric, 6)::float8 AS score, e.guid
+        FROM {table.name} e WHERE {where}
+    ) m'''
+    if after:
+        sql += ' WHERE score < %(score)s OR (score = %(score)s AND guid > %(guid)s)'
+        params.update(score=after[0], guid=after[1])
+    sql += ' ORDER BY score DESC, guid LIMIT %(size)s'
+    params['size'] = size
+    return _fetch(sql, params), total
+
+
+def _nearest(table, q, tags, lonlat, size, after):
+    """[(-distance, guid)] of the `size` matches nearest to `lonlat`, and the
+    total number of matches."""
+    conditions, params = _filters(table, q, tags)
+    total = _total(table, conditions, params)
+
+    params.update(origin=_origin(lonlat), start=0)
+    if after:
+        conditions.append(
+            '(n.distance > %(distance)s OR '
+            '(n.distance = %(distance)s AND e.guid > %(guid)s))')
+        params.update(
+            start=-after[0] - 0.001, distance=-after[0], guid=after[1])
+    joined = ' AND '.join([f'e.{table.locatie} = n.guid'] + conditions)
+    sql = f'''WITH nearest AS (
+        SELECT l.guid, round((
+            l.geometrie <-> ST_GeomFromText(%(origin)s, 28992))::numeric, 3
+        )::float8 AS distance
+        FROM {_LOCATIE} l
+        WHERE l.geometrie IS NOT NULL
+          AND l.geometrie <-> ST_GeomFromText(%(origin)s, 28992) >= %(start)s
+        ORDER BY l.geometrie <-> ST_GeomFromText(%(origin)s, 28992)
+        LIMIT %(candidates)s
+    )
+    SELECT n.guid, n.distance, e.guid FROM nearest n
+    LEFT JOIN {table.name} e ON {joined}
+    ORDER BY n.distance, e.guid'''
+
+    candidates = size * 4
+    while True:
+        params['candidates'] = candidates
+        rows = _fetch(sql, params)
+        hits = [(-distance, guid) for _, distance, guid in rows if guid]
+        if len(hits) >= size or len({row[0] for row in rows}) < candidates \
+                or candidates >= settings.SEARCH_FALLBACK_MAX_CANDIDATES:
+            return hits[:size], total
+        candidates = min(candidates * 4, settings.SEARCH_FALLBACK_MAX_CANDIDATES)
+
+
+def _project(source, fields):
+    """`source` with only `fields`, which may be dotted paths."""
+    projected = {}
+    for field in fields:
+        value, target, parts = source, projected, field.split('.')
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    return projected
+
+
+def _hits(doctype, ranked, source, compact, geo):
+    queryset, factory = sync.DOCTYPES[doctype]
+    objects = queryset().in_bulk([guid for _, guid in ranked])
+    hits = []
+    for sort, guid in ranked:
+        if guid not in objects:
+            # Deleted since it was ranked
+            continue
+        doc = factory(objects[guid]).to_dict(skip_empty=False)
+        hit = {
+            '_id': guid,
+            '_type': doctype,
+            # Distance decay, half at a kilometer
+            '_score': 1 / (1 - sort / 1000) if geo else sort,
+            '_source': _project(doc, source) if source else doc,
+            'sort': [sort, guid],
+        }
+        if compact and doc.get('beschrijving'):
+            hit['highlight'] = {'beschrijving': [doc['beschrijving'][:150]]}
+        hits.append(hit)
+    return hits
+
+
+def _origin(lonlat):
+    origin = Point(*lonlat, srid=4326)
+    origin.transform(28992)
+    return origin.wkt
+
+
+def _tag_buckets(q, tags):
+    """Terms buckets of the tags of the matching activiteiten."""
+    conditions, params = _filters(TABLES['activiteit'], q, tags)
+    rows = _fetch(f'''SELECT t.naam, count(*) FROM {_TAGS} at
+        JOIN {_TAG_DEFINITIONS} t ON t.id = at.tagdefinition_id
+        WHERE at.activiteit_id IN (
+            SELECT e.guid FROM {TABLES['activiteit'].name} e
+            WHERE {' AND '.join(conditions) or 'TRUE'})
+        GROUP BY t.naam ORDER BY count(*) DESC, t.naam
+        LIMIT %(facet_size)s''', dict(params, facet_size=elastic.FACET_SIZE))
+    return [{'key': naam, 'doc_count': count} for naam, count in rows]
+
+
+def _distance_counts(table, q, tags, lonlat):
+    """Number of matches in each of the distance ranges."""
+    conditions, params = _filters(table, q, tags)
+    ranges = elastic.distance_ranges()
+    counts = ', '.join(
+        'count(*) FILTER (WHERE TRUE' +
+        (f" AND d >= {bucket['from']}" if 'from' in bucket else '') +
+        (f" AND d < {bucket['to']}" if 'to' in bucket else '') + ')'
+        for bucket in ranges)
+    params['origin'] = _origin(lonlat)
+    return _fetch(f'''SELECT {counts} FROM (
+        SELECT ST_Distance(l.geometrie, ST_GeomFromText(%(origin)s, 28992)) AS d
+        FROM {table.name} e JOIN {_LOCATIE} l ON l.guid = e.{table.locatie}
+        WHERE l.geometrie IS NOT NULL AND {' AND '.join(conditions) or 'TRUE'}
+    ) m''', params)[0]
+
+
+def _distance_buckets(doctypes, q, tags, lonlat):
+    """Range buckets like those of a geo_distance aggregation."""
+    totals = [0] * len(elastic.distance_ranges())
+    for name in doctypes:
+        counts = _distance_counts(TABLES[name], q, tags, lonlat)
+        totals = [total + count for total, count in zip(totals, counts)]
+    buckets = []
+    for bucket, count in zip(elastic.distance_ranges(), totals):
+        bucket = {key: float(value) for key, value in bucket.items()}
+        bucket['key'] = '%s-%s' % (bucket.get('from', '*'), bucket.get('to', '*'))
+        bucket['doc_count'] = count
+        buckets.append(bucket)
+    return buckets
+
+
+def _facets(doctypes, q, tags, lonlat, totals):
+    """Buckets of the facet aggregations of :func:`elastic.facet_aggs`."""
+    aggregations = {
+        'tags': {'buckets': _tag_buckets(q, tags) if 'activiteit' in doctypes else []},
+        'doctype': {'buckets': [
+            {'key': name, 'doc_count': count} for name, count in
+            sorted(totals.items(), key=lambda item: (-item[1], item[0])) if count]},
+    }
+    if lonlat:
+        aggregations['distance'] = {
+            'buckets': _distance_buckets(doctypes, q, tags, lonlat)}
+    return aggregations
+
+
+def search(q='', doctype=None, lonlat=None, tags=None, fields=None,
+           compact=False, size=None, after=None, facets=False):
+    """JSON encoded search results, shaped like those of
+    :func:`elastic.search`."""
+    start = time.time()
+    size = size or settings.SEARCH_PAGE_SIZE
+    source = fields or (
+        elastic.COMPACT_SOURCE if compact else settings.ELASTIC_SEARCH_SOURCE)
+    doctypes = [doctype] if doctype else list(TABLES)
+    if tags:
+        # Only activiteiten have tags
+        doctypes = [d for d in doctypes if TABLES[d].tags]
+
+    try:
+        results, totals = [], {}
+        for name in doctypes:
+            if lonlat:
+                ranked, count = _nearest(
+                    TABLES[name], q, tags, lonlat, size, after)
+            else:
+                ranked, count = _ranked(TABLES[name], q, tags, size, after)
+            results.extend((sort, guid, name) for sort, guid in ranked)
+            totals[name] = count
+        total = sum(totals.values())
+        results.sort(key=lambda result: (-result[0], result[1]))
+        results = results[:size]
+
+        hits = []
+        for name in doctypes:
+            ranked = [(sort, guid) for sort, guid, d in results if d == name]
+            hits.extend(_hits(name, ranked, source, compact, bool(lonlat)))
+        aggregations = facets and _facets(doctypes, q, tags, lonlat, totals)
+    except Exception as e:
+        raise elastic.SearchError() from e
+    hits.sort(key=lambda hit: (-hit['sort'][0], hit['sort'][1]))
+
+    response = {
+        'took': int((time.time() - start) * 1000),
+        'hits': {
+            'total': total,
+            'max_score': max((hit['_score'] for hit in hits), default=None),
+            'hits': hits,
+        },
+    }
+    if facets:
+        response['aggregations'] = aggregations
+    return json.dumps(response)
@@ -0,0 +1,111 @@
+"""The TagDefinitions, in memory.
+
+Tags are a small, closed set that hardly ever changes, so every process
+keeps all of them in a ``TagRegistry`` instead of querying them per request.
+Once a write to ``TagDefinition`` commits, the writing process drops its
+registry. Other processes notice the new ``tags`` stamp of :mod:`versions`,
+which they check at most once per SEARCH_CACHE_GENERATION_CHECK seconds.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import models, versions
+
+
+class TagRegistry:
+    """Snapshot of the TagDefinitions.
+
+    Names are matched case-insensitively and without surrounding whitespace,
+    and come out as they are defined.
+    """
+
+    def __init__(self, definitions):
+        self.ids = {}
+        self.categories = {}
+        self._names = {}
+        for tag_id, naam, category in definitions:
+            self.ids[naam] = tag_id
+            self.categories.setdefault(category, []).append(naam)
+            self._names[naam.strip().casefold()] = naam
+
+    def __len__(self):
+        return len(self.ids)
+
+    def names(self, category=None) -> list:
+        """Names of all tags, or of the tags in `category`."""
+        if category is None:
+            return list(self.ids)
+        return list(self.categories.get(category, ()))
+
+    def lookup(self, name):
+        """The defined name for `name`, None for an unknown tag."""
+        return self._names.get(str(name).strip().casefold())
+
+    def resolve(self, names) -> dict:
+        """{name: id} for the known tags among `names`."""
+        resolved = {}
+        for name in names:
+            naam = self.lookup(name)
+            if naam is not None:
+                resolved[name] = self.ids[naam]
+        return resolved
+
+    def normalize(self, names) -> list:
+        """The defined names for `names`, sorted and distinct.
+
+        Raises ValueError for unknown tags.
+        """
+        normalized, unknown = set(), []
+        for name in names:
+            naam = self.lookup(name)
+            if naam is None:
+                unknown.append(name)
+            else:
+                normalized.add(naam)
+        if unknown:
+            raise ValueError(f'Unknown tags {unknown}')
+        return sorted(normalized)
+
+
+def load() -> TagRegistry:
+    return TagRegistry(models.TagDefinition.objects.order_by('id').values_list(
+        'id', 'naam', 'category'))
+
+
+_lock = threading.Lock()
+_registry = None
+_stamp = None
+_checked = 0
+
+
+def tags() -> TagRegistry:
+    """The registry of this process, reloaded when the tags changed."""
+    global _registry, _stamp, _checked
+    now = time.monotonic()
+    registry = _registry
+    if registry is not None and \
+            now - _checked < settings.SEARCH_CACHE_GENERATION_CHECK:
+        return registry
+    _checked = now
+    stamp = versions.stamps('tags')
+    with _lock:
+        if _registry is None or stamp != _stamp:
+            _registry, _stamp = load(), stamp
+        return _registry
+
+
+def invalidate():
+    global _registry
+    _registry = None
+
+
+@receiver(post_save, sender=models.TagDefinition)
+@receiver(post_delete, sender=models.TagDefinition)
+def _tag_changed(sender, **kwargs):
+    # Not before the commit, or a rollback would leave the change loaded
+    transaction.on_commit(invalidate)
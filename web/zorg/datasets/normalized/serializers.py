@@ -1,10 +1,47 @@
+# Python
+import time
+
 # Packages
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from rest_framework import serializers
 
 # Projects
 from . import models
 
+# user id -> (Profile.guid, expiry). Save and delete of a Profile clear the
+# entry in this process, the expiry bounds how long other processes can use
+# a changed guid.
+_guid_prefixes = {}
+
+
+def guid_prefix(user: User) -> str:
+    """
+    The Profile.guid of the user. Memoized on the user object, so a single
+    request never looks it up twice, and cached per process so most
+    requests don't look it up at all.
+    """
+    try:
+        return user._guid_prefix
+    except AttributeError:
+        pass
+    prefix, expires = _guid_prefixes.get(user.pk, (None, 0))
+    if expires < time.monotonic():
+        prefix = models.Profile.objects.values_list(
+            'guid', flat=True).get(auth_user=user)
+        _guid_prefixes[user.pk] = (
+            prefix, time.monotonic() + settings.PROFILE_GUID_CACHE_TTL)
+    user._guid_prefix = prefix
+    return prefix
+
+
+@receiver(post_save, sender=models.Profile)
+@receiver(post_delete, sender=models.Profile)
+def _profile_changed(sender, instance, **kwargs):
+    _guid_prefixes.pop(instance.auth_user_id, None)
+
 
 # For now, using a simple implemetation of concatinating the
 # user identifier with the external id, using a dash to
@@ -19,11 +56,11 @@ def guid_from_id(user_identifier: User, ext_id: str) -> str:
     others data, while mainting a reversible reference to the own
     user's id
     """
-    profile = models.Profile.objects.get(auth_user=user_identifier)
+    prefix = guid_prefix(user_identifier)
     if ext_id != '':
-        return f"{profile.guid}-{ext_id}"
+        return f"{prefix}-{ext_id}"
     else:
-        return profile.guid
+        return prefix
 
 
 class ZorgModelSerializer(serializers.ModelSerializer):
@@ -79,3 +116,11 @@ class ActiviteitSerializer(ZorgModelSerializer):
     class Meta(object):
         exclude = ('locatie', 'organisatie',)
         model = models.Activiteit
+
+
+class BatchJobSerializer(serializers.ModelSerializer):
+    jobid = serializers.IntegerField(source='id', read_only=True)
+
+    class Meta(object):
+        fields = ('jobid', 'guid', 'status', 'result', 'created', 'started', 'finished')
+        model = models.BatchJob
@@ -0,0 +1,195 @@
+"""Near-real-time sync of model changes to the search index.
+
+Signal handlers add the guids of changed rows to a dirty set in Redis once the
+surrounding transaction commits, and queue a flush job on the ``low`` queue
+unless one is already waiting. The worker takes the complete dirty set at
+once, so all changes that came in while it was busy are sent in one bulk
+request. When that request fails the guids go back into the dirty set, and
+a new flush is queued that first waits a while (rq has no delayed jobs).
+
+Changes to a ``Locatie`` or ``Organisatie`` cascade to the ``Activiteit``
+documents that belong to it, as those embed the locatie. The ``Term``
+documents whose gewicht changed go along in the same bulk request.
+"""
+import itertools
+import logging
+import time
+
+import django_rq
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete)
+from django.dispatch import receiver
+from elasticsearch.helpers import bulk
+
+from . import documents, elastic, models, terms, versions
+
+_logger = logging.getLogger(__name__)
+
+_QUEUE = 'low'
+_DIRTY_KEY = 'zorg:sync:dirty:{}'
+_SCHEDULED_KEY = 'zorg:sync:scheduled'
+
+# doctype -> (queryset, document factory)
+DOCTYPES = {
+    'activiteit': (
+        lambda: models.Activiteit.objects
+        .select_related('locatie', 'organisatie').prefetch_related('tags'),
+        documents.from_activiteit),
+    'locatie': (
+        lambda: models.Locatie.objects.all(), documents.from_locatie),
+    'organisatie': (
+        lambda: models.Organisatie.objects.all(), documents.from_organisatie),
+}
+_MODEL_DOCTYPES = {
+    models.Activiteit: 'activiteit',
+    models.Locatie: 'locatie',
+    models.Organisatie: 'organisatie',
+}
+
+
+def mark_dirty(doctype: str, guids):
+    """Schedule the documents of `guids` for reindexing once the current
+    transaction commits."""
+    guids = list(guids)
+    if settings.ELASTIC_SYNC and guids:
+        transaction.on_commit(lambda: _publish(doctype, guids))
+
+
+def _publish(doctype, guids):
+    try:
+        redis = django_rq.get_connection(_QUEUE)
+        redis.sadd(_DIRTY_KEY.format(doctype), *guids)
+        scheduled = redis.set(
+            _SCHEDULED_KEY, 1, nx=True, ex=settings.ELASTIC_SYNC_SCHEDULE_TTL)
+        if scheduled:
+            django_rq.get_queue(_QUEUE).enqueue(flush)
+    except Exception:
+        # The database write succeeded, the next full build will repair the
+        # index.
+        _logger.exception('Could not schedule %s for reindexing', doctype)
+
+
+def _take(redis, doctype):
+    key = _DIRTY_KEY.format(doctype)
+    pipe = redis.pipeline()
+    pipe.smembers(key)
+    pipe.delete(key)
+    members, _ = pipe.execute()
+    return {guid.decode() for guid in members}
+
+
+def _restore(redis, dirty):
+    """Put the guids of a failed flush back, for the next one."""
+    pipe = redis.pipeline()
+    for doctype, guids in dirty.items():
+        if guids:
+            pipe.sadd(_DIRTY_KEY.format(doctype), *guids)
+    pipe.execute()
+
+
+def _retry(redis, attempt):
+    if attempt > settings.ELASTIC_SYNC_RETRIES:
+        _logger.error('Giving up on flushing after %d retries, the next '
+                      'change schedules a new flush', attempt - 1)
+        return
+    # Unless a new change already queued a flush
+    scheduled = redis.set(
+        _SCHEDULED_KEY, 1, nx=True, ex=settings.ELASTIC_SYNC_SCHEDULE_TTL)
+    if scheduled:
+        django_rq.get_queue(_QUEUE).enqueue(flush, attempt)
+
+
+def flush(attempt=0):
+    """RQ job: reindex everything in the dirty sets with one bulk request.
+
+    `attempt` counts the retries after failed flushes, which wait
+    ELASTIC_SYNC_RETRY_DELAY seconds, doubling with every attempt.
+    """
+    if attempt:
+        time.sleep(settings.ELASTIC_SYNC_RETRY_DELAY * 2 ** (attempt - 1))
+    redis = django_rq.get_connection(_QUEUE)
+    # Changes arriving from now on need a new job
+    redis.delete(_SCHEDULED_KEY)
+    dirty = {doctype: _take(redis, doctype) for doctype in DOCTYPES}
+    try:
+        if dirty['locatie'] or dirty['organisatie']:
+            dirty['activiteit'].update(
+                models.Activiteit.objects.filter(
+                    Q(locatie__in=dirty['locatie']) |
+                    Q(organisatie__in=dirty['organisatie'])
+                ).values_list('guid', flat=True))
+
+        # The TermBron updates of terms.actions only stick if the bulk
+        # request gets through, or the Term documents would never catch up
+        with transaction.atomic():
+            ok, errors = bulk(
+                elastic._elasticsearch(),
+                itertools.chain(
+                    _actions(dirty),
+                    terms.actions(dirty, settings.ELASTIC_INDEX)),
+                chunk_size=settings.ELASTIC_BULK_CHUNK_SIZE,
+                raise_on_error=False,
+                # Visible before cached search responses are invalidated below
+                refresh='wait_for')
+    except Exception:
+        # Elastic is down or timed out: keep the changes for a later flush
+        _restore(redis, dirty)
+        _retry(redis, attempt + 1)
+        raise
+    for error in errors:
+        if error.get('delete', {}).get('status') != 404:
+            _logger.error('Failed to sync document: %s', error)
+    versions.bump_index_generation()
+    return ok
+
+
+def _actions(dirty):
+    """Index actions for existing rows, delete actions for removed ones."""
+    chunk_size = settings.ELASTIC_BULK_CHUNK_SIZE
+    for doctype, guids in dirty.items():
+        queryset, factory = DOCTYPES[doctype]
+        guids = sorted(guids)
+        for i in range(0, len(guids), chunk_size):
+            chunk = guids[i:i + chunk_size]
+            found = set()
+            for obj in queryset().filter(pk__in=chunk):
+                found.add(obj.pk)
+                yield dict(
+                    factory(obj).to_dict(include_meta=True, skip_empty=False),
+                    _index=settings.ELASTIC_INDEX)
+            for guid in set(chunk) - found:
+                yield {
+                    '_op_type': 'delete',
+                    '_index': settings.ELASTIC_INDEX,
+                    '_type': doctype,
+                    '_id': guid,
+                }
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def _model_changed(sender, instance, **kwargs):
+    doctype = _MODEL_DOCTYPES.get(sender)
+    if doctype is not None:
+        mark_dirty(doctype, [instance.pk])
+
+
+@receiver(m2m_changed, sender=models.Activiteit.tags.through)
+def _tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # Afterwards we can't tell which activiteiten had this tag
+        mark_dirty('activiteit', instance.activiteiten.values_list(
+            'guid', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        mark_dirty('activiteit', (pk_set or ()) if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=models.TagDefinition)
+@receiver(pre_delete, sender=models.TagDefinition)
+def _tag_changed(sender, instance, created=False, **kwargs):
+    if not created:
+        mark_dirty('activiteit', instance.activiteiten.values_list(
+            'guid', flat=True))
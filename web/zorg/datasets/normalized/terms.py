@@ -0,0 +1,226 @@
+"""Vocabulary for the typeahead ``Term`` documents.
+
+The words of the naam and beschrijving of every activiteit, organisatie and
+locatie are tokenized like the ``dutchanalyzer`` of the documents does
+(standard tokenizer, lowercase, Dutch stopwords). Full names of more than one
+word and the tag names of activiteiten are terms as well. The ``gewicht`` of
+a term is the number of entities it occurs in.
+
+The words of every entity are kept in ``TermBron``, so a change to a few
+entities only needs those to be tokenized again, plus a count of the terms
+that they gained or lost.
+"""
+import collections
+import heapq
+import itertools
+import operator
+import re
+import tempfile
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import documents, models, versions
+
+# Elastic's _dutch_ stopwords
+STOPWORDS = frozenset("""
+    de en van ik te dat die in een hij het niet zijn is was op aan met als
+    voor had er maar om hem dan zou of wat mijn men dit zo door over ze zich
+    bij ook tot je mij uit der daar haar naar heb hoe heeft hebben deze u
+    want nog zal me zij nu ge geen omdat iets worden toch al waren veel meer
+    doen toen moet ben zonder kan hun dus alles onder ja eens hier wie werd
+    altijd doch wordt wezen kunnen ons zelf tegen na reeds wil kon niets uw
+    iemand geweest andere
+""".split())
+
+_WORD = re.compile(r'\w+')
+_MAX_LENGTH = 255
+
+# doctype -> queryset of the entities
+SOURCES = {
+    'activiteit': lambda: models.Activiteit.objects.prefetch_related('tags'),
+    'locatie': lambda: models.Locatie.objects.all(),
+    'organisatie': lambda: models.Organisatie.objects.all(),
+}
+
+
+def tokens(*texts) -> set:
+    """Distinct words of `texts`, without stopwords and numbers."""
+    words = set()
+    for text in texts:
+        for word in _WORD.findall((text or '').lower()):
+            if len(word) > 1 and not word.isdigit() and word not in STOPWORDS:
+                words.add(word)
+    return words
+
+
+def _phrase(text):
+    return ' '.join((text or '').lower().split())[:_MAX_LENGTH]
+
+
+def entity_tokens(doctype, obj) -> set:
+    """Terms an entity counts towards."""
+    words = tokens(obj.naam, getattr(obj, 'beschrijving', ''))
+    naam = _phrase(obj.naam)
+    if ' ' in naam:
+        words.add(naam)
+    if doctype == 'activiteit':
+        words.update(_phrase(tag.naam) for tag in obj.tags.all())
+    return {word for word in words if len(word) <= _MAX_LENGTH}
+
+
+class SpillCounter:
+    """Counter that keeps at most `limit` keys in memory.
+
+    When it grows beyond that, the counts are written to a temporary file
+    in key order and the counter starts over. `items` merges these runs.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.counts = collections.Counter()
+        self.runs = []
+
+    def update(self, keys):
+        self.counts.update(keys)
+        if len(self.counts) > self.limit:
+            self._spill()
+
+    def _spill(self):
+        run = tempfile.TemporaryFile('w+', encoding='utf-8')
+        run.writelines(
+            f'{key}\t{count}\n' for key, count in sorted(self.counts.items()))
+        run.seek(0)
+        self.runs.append(run)
+        self.counts.clear()
+
+    @staticmethod
+    def _read(run):
+        for line in run:
+            key, _, count = line.rstrip('\n').rpartition('\t')
+            yield key, int(count)
+
+    def items(self):
+        """(key, count) pairs in key order."""
+        streams = [self._read(run) for run in self.runs]
+        streams.append(iter(sorted(self.counts.items())))
+        try:
+            merged = heapq.merge(*streams)
+            for key, group in itertools.groupby(
+                    merged, key=operator.itemgetter(0)):
+                yield key, sum(count for _, count in group)
+        finally:
+            for run in self.runs:
+                run.close()
+            self.runs = []
+            self.counts.clear()
+
+
+def _batches(queryset, size):
+    """Lists of `size` rows in primary key order (keyset paging)."""
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        batch = list(page[:size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1].pk
+
+
+def generate(size=None):
+    """All terms with their gewicht, in term order.
+
+    Tokenizes every entity and stores its words in ``TermBron`` from
+    scratch. Counting spills to disk beyond TERMS_MEMORY_LIMIT distinct
+    terms.
+    """
+    size = size or settings.ELASTIC_BULK_CHUNK_SIZE
+    counter = SpillCounter(settings.TERMS_MEMORY_LIMIT)
+    with transaction.atomic():
+        models.TermBron.objects.all().delete()
+        for doctype, queryset in SOURCES.items():
+            for batch in _batches(queryset(), size):
+                bronnen = []
+                for obj in batch:
+                    words = entity_tokens(doctype, obj)
+                    counter.update(words)
+                    bronnen.append(models.TermBron(
+                        doctype=doctype, guid=obj.pk, tokens=sorted(words)))
+                models.TermBron.objects.bulk_create(bronnen)
+    transaction.on_commit(versions.bump_terms_generation)
+    yield from counter.items()
+
+
+def update(changes, size=None) -> set:
+    """Tokenize the entities in `changes` ({doctype: guids}) again.
+
+    Returns the terms whose gewicht may have changed.
+    """
+    size = size or settings.ELASTIC_BULK_CHUNK_SIZE
+    affected = set()
+    with transaction.atomic():
+        for doctype, guids in changes.items():
+            guids = sorted(guids)
+            for i in range(0, len(guids), size):
+                chunk = guids[i:i + size]
+                stored = models.TermBron.objects.filter(
+                    doctype=doctype, guid__in=chunk)
+                old = dict(stored.values_list('guid', 'tokens'))
+                new = {
+                    obj.pk: entity_tokens(doctype, obj)
+                    for obj in SOURCES[doctype]().filter(pk__in=chunk)}
+                for guid in chunk:
+                    affected.update(
+                        set(old.get(guid, ())) ^ new.get(guid, set()))
+                stored.delete()
+                models.TermBron.objects.bulk_create(
+                    models.TermBron(
+                        doctype=doctype, guid=guid, tokens=sorted(words))
+                    for guid, words in new.items())
+    return affected
+
+
+def _count(terms=None) -> collections.Counter:
+    """Number of entities per term, for all terms or just `terms`."""
+    table = models.TermBron._meta.db_table
+    sql = f'SELECT token, count(*) FROM (SELECT unnest(tokens) AS token FROM {table}'
+    params = []
+    if terms is not None:
+        # && uses the GIN index on tokens
+        sql += ' WHERE tokens && %s::varchar[]) t WHERE token = ANY(%s)'
+        params = [list(terms), list(terms)]
+    else:
+        sql += ') t'
+    with connection.cursor() as cursor:
+        cursor.execute(sql + ' GROUP BY token', params)
+        return collections.Counter(dict(cursor.fetchall()))
+
+
+def vocabulary() -> collections.Counter:
+    """gewicht of every term, as of the latest (incremental) run."""
+    return _count()
+
+
+def actions(changes, index):
+    """Bulk actions that bring the ``Term`` documents up to date with
+    `changes` ({doctype: guids})."""
+    affected = update(changes)
+    if not affected:
+        return
+    transaction.on_commit(versions.bump_terms_generation)
+    gewichten = _count(affected)
+    for term in sorted(affected):
+        if gewichten[term]:
+            yield dict(
+                documents.from_term(term, gewichten[term]).to_dict(
+                    include_meta=True, skip_empty=False),
+                _index=index)
+        else:
+            yield {
+                '_op_type': 'delete',
+                '_index': index,
+                '_type': 'term',
+                '_id': term,
+            }
@@ -0,0 +1,117 @@
+# Python
+from unittest import mock
+
+# Packages
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+# Project
+from datasets.normalized import batch, models, registry
+
+
+@override_settings(ELASTIC_SYNC=False, BATCH_CHUNK_SIZE=2)
+class BatchProcessTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='te01')
+        models.Profile.objects.create(
+            auth_user=self.user, guid='te01', naam='te01', contact={})
+        models.TagDefinition.objects.create(naam='maandag', category='DAG')
+
+    def run_batch(self, records):
+        job = models.BatchJob.objects.create(auth_user=self.user, guid='te01')
+        batch.process(job.pk, records)
+        job.refresh_from_db()
+        return job
+
+    def record(self, operatie, **activiteit):
+        return {
+            'operatie': operatie,
+            'locatie': {'id': '1', 'naam': 'locatie'},
+            'activiteit': dict(
+                {'id': '1', 'naam': 'activiteit', 'bron_link': 'http://localhost'},
+                **activiteit),
+        }
+
+    def test_insert_and_patch(self):
+        job = self.run_batch([self.record('insert', tags=['maandag'])])
+        self.assertEqual(job.status, 'success')
+        self.assertEqual(job.result['added'], 2)
+        activiteit = models.Activiteit.objects.get(guid='te01-1')
+        self.assertEqual(activiteit.locatie_id, 'te01-1')
+        self.assertEqual([t.naam for t in activiteit.tags.all()], ['maandag'])
+
+        job = self.run_batch([self.record('patch', naam='nieuw')])
+        self.assertEqual(job.result['updated'], 2)
+        self.assertEqual(models.Activiteit.objects.get(guid='te01-1').naam, 'nieuw')
+
+    def test_tag_defined_after_loading(self):
+        registry.tags()
+        models.TagDefinition.objects.create(naam='dinsdag', category='DAG')
+        job = self.run_batch([self.record('insert', tags=['dinsdag'])])
+        self.assertEqual(job.result['errors'], [])
+        self.assertEqual(
+            [t.naam for t in models.Activiteit.objects.get(guid='te01-1').tags.all()],
+            ['dinsdag'])
+
+    def test_record_errors(self):
+        job = self.run_batch([
+            self.record('insert'),
+            self.record('patch', id='2'),
+            self.record('insert', id='3', tags=['onbekend']),
+            {'operatie': 'upsert'},
+        ])
+        self.assertEqual(job.status, 'success')
+        self.assertEqual(job.result['processed'], 4)
+        self.assertEqual(
+            sorted(error['index'] for error in job.result['errors']), [1, 2, 3])
+        self.assertEqual(
+            list(models.Activiteit.objects.values_list('guid', flat=True)), ['te01-1'])
+
+    def test_delete(self):
+        self.run_batch([self.record('insert')])
+        job = self.run_batch([{
+            'operatie': 'delete', 'locatie': 'te01-1', 'activiteit': 'te01-1'}])
+        self.assertEqual(job.result['deleted'], 2)
+        self.assertFalse(models.Locatie.objects.exists())
+
+        job = self.run_batch([{'operatie': 'delete', 'activiteit': 'xx01-1'}])
+        self.assertEqual(len(job.result['errors']), 1)
+
+    def test_delete_only_its_own_kind(self):
+        self.run_batch([self.record('insert')])
+        job = self.run_batch([{'operatie': 'delete', 'activiteit': 'te01-1'}])
+        self.assertEqual(job.result['deleted'], 1)
+        self.assertTrue(models.Locatie.objects.filter(guid='te01-1').exists())
+
+    @mock.patch('datasets.normalized.batch._save_tags', side_effect=Exception('boom'))
+    def test_failed_chunk(self, save_tags):
+        job = self.run_batch([
+            self.record('insert', tags=['maandag']),
+            self.record('insert', id='2', tags=['onbekend']),
+        ])
+        self.assertFalse(models.Activiteit.objects.exists())
+        self.assertEqual((job.result['added'], job.result['updated']), (0, 0))
+        self.assertEqual(
+            [(error['index'], error['message']) for error in job.result['errors']],
+            [(0, 'boom'), (1, 'boom')])
+
+    def test_record_failing_twice(self):
+        # A locatie without naam and an activiteit with an unknown tag
+        bad = dict(self.record('insert', tags=['onbekend']), locatie={'id': '1'})
+        job = self.run_batch([bad])
+        self.assertGreater(len(job.result['errors']), 1)
+        self.assertEqual(job.status, 'failed')
+
+        job = self.run_batch([bad, self.record('insert', id='2')])
+        self.assertEqual(job.status, 'success')
+        self.assertEqual(job.result['messages'], '1 record(s) failed')
+
+    def test_record_shape(self):
+        job = self.run_batch([
+            dict(self.record('insert'), locatie='te01-1'),
+            self.record('insert', id='2'),
+        ])
+        self.assertEqual([error['index'] for error in job.result['errors']], [0])
+        self.assertEqual(
+            list(models.Activiteit.objects.values_list('guid', flat=True)), ['te01-2'])
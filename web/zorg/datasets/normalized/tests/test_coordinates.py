@@ -0,0 +1,42 @@
+# Packages
+from django.contrib.gis.geos import Point
+from django.test import SimpleTestCase, TestCase, override_settings
+
+# Project
+from datasets.normalized import coordinates, models
+
+
+class ToWgs84Test(SimpleTestCase):
+
+    def test_batch(self):
+        dam = Point(121400, 487400, srid=28992)
+        wgs84 = Point(4.895, 52.373, srid=4326)
+        result = coordinates.to_wgs84([dam, None, wgs84])
+        self.assertIsNone(result[1])
+        for point in (result[0], result[2]):
+            self.assertEqual(point.srid, 4326)
+            self.assertAlmostEqual(point.x, 4.895, places=2)
+            self.assertAlmostEqual(point.y, 52.373, places=2)
+
+    def test_matches_geos(self):
+        point = Point(120000, 485000, srid=28992)
+        expected = point.transform(4326, clone=True)
+        result, = coordinates.to_wgs84([point])
+        self.assertAlmostEqual(result.x, expected.x, places=6)
+        self.assertAlmostEqual(result.y, expected.y, places=6)
+
+
+@override_settings(ELASTIC_SYNC=False)
+class CentroidTest(TestCase):
+
+    def test_maintained_on_save(self):
+        locatie = models.Locatie.objects.create(
+            guid='te01-1', id='1', naam='locatie',
+            geometrie=Point(121400, 487400, srid=28992))
+        locatie.refresh_from_db()
+        self.assertAlmostEqual(locatie.centroid.y, 52.373, places=2)
+
+        locatie.geometrie = None
+        locatie.save(update_fields=['geometrie'])
+        locatie.refresh_from_db()
+        self.assertIsNone(locatie.centroid)
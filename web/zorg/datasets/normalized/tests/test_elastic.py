@@ -0,0 +1,219 @@
+# Python
+import json
+import math
+from unittest import mock
+
+# Packages
+from django.test import SimpleTestCase, override_settings
+
+# Project
+from datasets.normalized import elastic
+
+
+def _distance(a, b):
+    """Approximate distance in meters between two nearby lon/lat points."""
+    dx = (a[0] - b[0]) * 111320 * math.cos(math.radians(a[1]))
+    dy = (a[1] - b[1]) * 111320
+    return math.hypot(dx, dy)
+
+
+class SnapLonLatTest(SimpleTestCase):
+
+    def test_nearby_origins_share_a_cell(self):
+        a = elastic.snap_lonlat((4.89001, 52.37001), 25)
+        b = elastic.snap_lonlat((4.89005, 52.37004), 25)
+        self.assertEqual(a, b)
+
+    def test_within_tolerance(self):
+        for lonlat in [(4.8901, 52.3701), (4.9123, 52.3456), (4.7777, 52.4001)]:
+            snapped = elastic.snap_lonlat(lonlat, 25)
+            self.assertLessEqual(_distance(lonlat, snapped), 25 / math.sqrt(2) + 0.1)
+
+
+_SORT = [{'_score': 'desc'}, {'guid': {'order': 'asc', 'unmapped_type': 'keyword'}}]
+
+
+class QueryTest(SimpleTestCase):
+
+    def test_stable_sort(self):
+        query = elastic.query('yoga')
+        self.assertEqual(query['sort'], _SORT)
+        self.assertNotIn('search_after', query)
+
+    @override_settings(SEARCH_PAGE_SIZE=50)
+    def test_search_after(self):
+        query = elastic.query('yoga', size=20, after=[1.5, 'te01-1'])
+        self.assertEqual(query['size'], 20)
+        self.assertEqual(query['search_after'], [1.5, 'te01-1'])
+        self.assertEqual(elastic.query('yoga')['size'], 50)
+
+
+_NOT_TERM = [{'type': {'value': 'term'}}]
+_MATCH = {'multi_match': {'query': 'yoga', 'fields': ['naam^1.5', 'beschrijving']}}
+_ALL = {'match_all': {}}
+
+
+@override_settings(SEARCH_PAGE_SIZE=50)
+class GoldenQueryTest(SimpleTestCase):
+    """The complete bool query for each combination of parameters.
+
+    Only the text query scores, doctype and tags are filters. Without a text
+    query every hit scores 1, so the distance function still ranks them.
+    """
+
+    cases = [
+        ({}, {'must_not': _NOT_TERM, 'must': _ALL}),
+        ({'q': 'yoga'}, {'must_not': _NOT_TERM, 'must': _MATCH}),
+        ({'doctype': 'activiteit'}, {
+            'must_not': _NOT_TERM,
+            'must': _ALL,
+            'filter': [{'type': {'value': 'activiteit'}}]}),
+        ({'tags': ['dinsdag', 'maandag']}, {
+            'must_not': _NOT_TERM,
+            'must': _ALL,
+            'filter': [{'term': {'tags': 'dinsdag'}}, {'term': {'tags': 'maandag'}}]}),
+        ({'q': 'yoga', 'doctype': 'activiteit', 'tags': ['maandag']}, {
+            'must_not': _NOT_TERM,
+            'must': _MATCH,
+            'filter': [{'type': {'value': 'activiteit'}}, {'term': {'tags': 'maandag'}}]}),
+    ]
+
+    def test_bool_queries(self):
+        for params, expected in self.cases:
+            with self.subTest(**params):
+                self.assertEqual(elastic.query(**params), {
+                    'sort': _SORT,
+                    'size': 50,
+                    'query': {'function_score': {'query': {'bool': expected}}},
+                })
+
+    def test_distance_scores(self):
+        query = elastic.query('yoga', tags=['maandag'], lonlat=(4.9, 52.37))
+        function_score = query['query']['function_score']
+        self.assertEqual(function_score['query']['bool']['filter'], [{'term': {'tags': 'maandag'}}])
+        self.assertEqual(
+            function_score['functions'][0]['gauss']['centroid']['origin'], {'lon': 4.9, 'lat': 52.37})
+
+    def test_distance_without_text(self):
+        query = elastic.query(doctype='locatie', lonlat=(4.9, 52.37))
+        function_score = query['query']['function_score']
+        self.assertEqual(function_score['query']['bool'], {
+            'must_not': _NOT_TERM,
+            'must': _ALL,
+            'filter': [{'type': {'value': 'locatie'}}]})
+        self.assertIn('gauss', function_score['functions'][0])
+
+
+class FacetsTest(SimpleTestCase):
+
+    def test_optional(self):
+        body, filter_path = elastic.search_request('yoga')
+        self.assertNotIn('aggs', body)
+        self.assertNotIn('aggregations.*.buckets', filter_path)
+
+    def test_same_request(self):
+        body, filter_path = elastic.search_request('yoga', facets=True)
+        self.assertEqual(set(body['aggs']), {'tags', 'doctype'})
+        self.assertEqual(body['aggs']['doctype'], {'terms': {'field': '_type'}})
+        self.assertIn('aggregations.*.buckets', filter_path)
+
+    def test_distance(self):
+        body, _ = elastic.search_request(lonlat=(4.9, 52.37), facets=True)
+        distance = body['aggs']['distance']['geo_distance']
+        self.assertEqual(distance['origin'], {'lon': 4.9, 'lat': 52.37})
+        self.assertEqual(distance['ranges'][0], {'to': 500})
+        self.assertEqual(distance['ranges'][-1], {'from': 5000})
+
+
+class SearchTest(SimpleTestCase):
+
+    @override_settings(ELASTIC_SEARCH_FILTER_PATH=['hits.hits._id'], ELASTIC_SEARCH_SOURCE=['naam'])
+    @mock.patch('datasets.normalized.elastic._raw_elasticsearch')
+    def test_passes_response_through(self, client):
+        body = '{"hits":{"total":1,"hits":[{"_id":"te01-1"}]}}'
+        client.return_value.search.return_value = body
+        self.assertIs(elastic.search(q='yoga'), body)
+        kwargs = client.return_value.search.call_args[1]
+        self.assertEqual(kwargs['filter_path'], ['hits.hits._id'])
+        self.assertEqual(kwargs['body']['_source'], ['naam'])
+
+    @mock.patch('datasets.normalized.elastic._raw_elasticsearch')
+    def test_empty_result(self, client):
+        # filter_path drops hits.hits when nothing matched
+        client.return_value.search.return_value = '{"took":1,"hits":{"total":0,"max_score":null}}'
+        self.assertEqual(json.loads(elastic.search(q='yoga')), {
+            'took': 1, 'hits': {'total': 0, 'max_score': None, 'hits': []}})
+
+    @mock.patch('datasets.normalized.elastic._raw_elasticsearch')
+    def test_compact_profile(self, client):
+        client.return_value.search.return_value = '{"hits":{"hits":[]}}'
+        elastic.search(q='yoga', compact=True)
+        kwargs = client.return_value.search.call_args[1]
+        self.assertEqual(kwargs['body']['_source'], elastic.COMPACT_SOURCE)
+        self.assertIn('beschrijving', kwargs['body']['highlight']['fields'])
+        self.assertIn('hits.hits.highlight', kwargs['filter_path'])
+
+        elastic.search(q='yoga', fields=['naam'], compact=True)
+        self.assertEqual(client.return_value.search.call_args[1]['body']['_source'], ['naam'])
+
+    @override_settings(ELASTIC_SNIFF=True, ELASTIC_SEARCH_HOSTS=['es1:9200', 'es2:9200'])
+    @mock.patch('datasets.normalized.elastic.Elasticsearch')
+    def test_raw_client_doesnt_sniff(self, client):
+        elastic._client()
+        self.assertTrue(client.call_args[1]['sniff_on_start'])
+        elastic._raw_elasticsearch.__wrapped__()
+        kwargs = client.call_args[1]
+        self.assertFalse(kwargs['sniff_on_start'])
+        self.assertFalse(kwargs['sniff_on_connection_fail'])
+        self.assertIsInstance(
+            kwargs['serializers']['application/json'], elastic._RawSerializer)
+
+    def test_raw_serializer(self):
+        self.assertEqual(elastic._RawSerializer().loads('{"a": 1}'), '{"a": 1}')
+        self.assertEqual(elastic._RawSerializer().dumps({'a': 1}), '{"a":1}')
+
+
+class CircuitBreakerTest(SimpleTestCase):
+
+    def _fail(self, breaker, status='N/A'):
+        with self.assertRaises(elastic.TransportError):
+            with breaker.guard():
+                raise elastic.TransportError(status, 'error')
+
+    def test_opens_after_overload_errors(self):
+        breaker = elastic.CircuitBreaker(failures=2, reset=60)
+        self._fail(breaker)
+        self.assertFalse(breaker.is_open)
+        self._fail(breaker, 429)
+        self.assertTrue(breaker.is_open)
+        with self.assertRaises(elastic.CircuitOpen):
+            breaker.check()
+
+    def test_ignores_bad_requests(self):
+        breaker = elastic.CircuitBreaker(failures=1, reset=60)
+        self._fail(breaker, 400)
+        self.assertFalse(breaker.is_open)
+
+    def test_closes_after_successful_trial(self):
+        breaker = elastic.CircuitBreaker(failures=1, reset=0)
+        self._fail(breaker)
+        with breaker.guard():
+            pass
+        self.assertIsNone(breaker._opened)
+
+
+class TypeaheadTest(SimpleTestCase):
+
+    def test_completion_suggest(self):
+        body = elastic.typeahead_query('yo')
+        self.assertEqual(body['suggest']['term']['prefix'], 'yo')
+        # 'yoga' and 'hatha yoga' both suggest "yoga", both should come back
+        self.assertNotIn('skip_duplicates', body['suggest']['term']['completion'])
+
+    def test_suggestions(self):
+        options = [{'_source': {'term': term}}
+                   for term in ('yoga', 'hatha yoga', 'yoga')]
+        results = {'suggest': {'term': [{'options': options}]}}
+        self.assertEqual(
+            elastic.typeahead_suggestions(results), '["yoga", "hatha yoga"]')
+        self.assertEqual(elastic.typeahead_suggestions({}), '[]')
@@ -0,0 +1,111 @@
+# Python
+import io
+import json
+import os
+import tempfile
+
+# Packages
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+
+# Project
+from datasets.normalized import importer, models
+
+
+class ReadJsonTest(SimpleTestCase):
+
+    def test_reads_across_chunks(self):
+        file = io.StringIO('[{"id": 1, "naam": "a, b"}, {"id": 2}]')
+        self.assertEqual(
+            list(importer.read_json(file, size=4)),
+            [{'id': 1, 'naam': 'a, b'}, {'id': 2}])
+
+    def test_incomplete(self):
+        with self.assertRaises(ValueError):
+            list(importer.read_json(io.StringIO('[{"id": 1}'), size=4))
+
+
+@override_settings(ELASTIC_SYNC=False)
+class ImporterTest(TestCase):
+
+    def setUp(self):
+        user = User.objects.create(username='te01')
+        self.profile = models.Profile.objects.create(
+            auth_user=user, guid='te01', naam='te01', contact={})
+        models.TagDefinition.objects.create(naam='maandag', category='DAG')
+        models.Locatie.objects.create(guid='te01-1', id='1', naam='Buurthuis')
+
+    def load(self, activiteiten):
+        loader = importer.Importer(self.profile, chunk_size=1)
+        loader.stage('locatie', [
+            {'id': '2', 'naam': 'Wijkcentrum', 'geometrie': 'POINT(121000 487000)'}])
+        loader.stage('activiteit', activiteiten)
+        loader.check()
+        return loader
+
+    def test_invalid_records(self):
+        loader = importer.Importer(self.profile)
+        loader.stage('locatie', [['1'], {'id': '3', 'naam': 'x', 'geometrie': 'POINT(1'}])
+        self.assertEqual(
+            [error for _, _, error in loader.errors],
+            ['Not an object', "Invalid geometrie 'POINT(1'"])
+
+    def test_dry_run(self):
+        with transaction.atomic():
+            loader = self.load([{'id': '1', 'naam': 'Yoga', 'locatie_id': '2'}])
+            diff = loader.diff()
+            transaction.set_rollback(True)
+        self.assertEqual(diff['locatie']['new']['examples'], ['te01-2'])
+        self.assertEqual(diff['activiteit']['new']['count'], 1)
+        self.assertFalse(models.Activiteit.objects.exists())
+
+    def test_merge(self):
+        loader = self.load([
+            {'id': '1', 'naam': 'Yoga', 'locatie_id': '1', 'tags': 'maandag, x',
+             'bron_link': 'http://localhost'},
+            {'id': '2', 'naam': 'Dans', 'locatie_id': '3'},
+            {'id': '3'},
+        ])
+        changed, result = loader.merge()
+
+        self.assertEqual(changed['activiteit'], {'te01-1'})
+        self.assertEqual(result['locatie']['added'], 1)
+        self.assertEqual(
+            [error for _, _, error in loader.errors],
+            ['Missing naam', 'Locatie te01-3 does not exist', 'Unknown tag x'])
+        activiteit = models.Activiteit.objects.get(guid='te01-1')
+        self.assertEqual(activiteit.locatie_id, 'te01-1')
+        self.assertEqual(
+            list(activiteit.tags.values_list('naam', flat=True)), ['maandag'])
+        locatie = models.Locatie.objects.get(guid='te01-2')
+        self.assertAlmostEqual(locatie.centroid.x, 4.9, places=1)
+
+        _, result = self.load([
+            {'id': '1', 'naam': 'Yoga', 'locatie_id': '1', 'tags': 'maandag',
+             'bron_link': 'http://localhost'}]).merge()
+        self.assertEqual(result['activiteit']['unchanged'], 1)
+
+
+@override_settings(ELASTIC_SYNC=False)
+class ImportCommandTest(TestCase):
+
+    def setUp(self):
+        user = User.objects.create(username='te01')
+        models.Profile.objects.create(
+            auth_user=user, guid='te01', naam='te01', contact={})
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'locatie.json')
+        with open(self.path, 'w', encoding='utf-8') as file:
+            json.dump([{'id': '1', 'naam': 'Buurthuis'}], file)
+
+    def test_dry_run(self):
+        out = io.StringIO()
+        call_command(
+            'import_zorg', self.path, profile='te01', dry_run=True,
+            verbosity=2, stdout=out)
+        self.assertIn('locatie: 1 new, 0 changed, 0 unchanged', out.getvalue())
+        self.assertIn('  new: te01-1', out.getvalue())
+        self.assertFalse(models.Locatie.objects.exists())
@@ -0,0 +1,97 @@
+# Python
+import json
+from unittest import mock
+
+# Packages
+from django.contrib.gis.geos import Point
+from django.test import TestCase, override_settings
+
+# Project
+from datasets.normalized import elastic, models, postgis
+
+
+def _rd(lon, lat):
+    point = Point(lon, lat, srid=4326)
+    point.transform(28992)
+    return point
+
+
+@override_settings(ELASTIC_SYNC=False)
+class PostgisSearchTest(TestCase):
+
+    def setUp(self):
+        for i, (naam, lonlat) in enumerate([
+                ('Hatha yoga', (4.90, 52.37)),
+                ('Yoga voor ouderen', (4.95, 52.37)),
+                ('Koken', (4.91, 52.37))]):
+            models.Locatie.objects.create(
+                guid=f'te01-{i}', id=str(i), naam=f'locatie {i}',
+                geometrie=_rd(*lonlat))
+            models.Activiteit.objects.create(
+                guid=f'te01-{i}', id=str(i), naam=naam,
+                bron_link='http://localhost', locatie_id=f'te01-{i}')
+
+    def search(self, **params):
+        return json.loads(postgis.search(doctype='activiteit', **params))['hits']
+
+    def test_nearest_first(self):
+        hits = self.search(lonlat=(4.949, 52.37), size=2)
+        self.assertEqual([h['_id'] for h in hits['hits']], ['te01-1', 'te01-2'])
+        self.assertEqual(hits['total'], 3)
+
+        after = hits['hits'][-1]['sort']
+        hits = self.search(lonlat=(4.949, 52.37), size=2, after=after)
+        self.assertEqual([h['_id'] for h in hits['hits']], ['te01-0'])
+
+    @override_settings(SEARCH_FALLBACK_MAX_TOTAL=2)
+    def test_bounded_total(self):
+        # Counting stops at the limit, a table this small has no estimate
+        self.assertEqual(self.search(lonlat=(4.949, 52.37))['total'], 2)
+        self.assertEqual(self.search(q='yoga')['total'], 2)
+
+    def test_nearest_matching(self):
+        hits = self.search(q='yoga', lonlat=(4.91, 52.37))
+        self.assertEqual([h['_id'] for h in hits['hits']], ['te01-0', 'te01-1'])
+
+    def test_facets(self):
+        maandag = models.TagDefinition.objects.create(naam='maandag', category='DAG')
+        for guid in ('te01-0', 'te01-1'):
+            models.Activiteit.objects.get(guid=guid).tags.add(maandag)
+        response = json.loads(postgis.search(
+            lonlat=(4.949, 52.37), size=1, facets=True))
+        aggregations = response['aggregations']
+        self.assertEqual(aggregations['tags']['buckets'], [{'key': 'maandag', 'doc_count': 2}])
+        self.assertEqual(aggregations['doctype']['buckets'], [
+            {'key': 'activiteit', 'doc_count': 3}, {'key': 'locatie', 'doc_count': 3}])
+        self.assertEqual(
+            [(b['key'], b['doc_count']) for b in aggregations['distance']['buckets']],
+            [('*-500.0', 2), ('500.0-1000.0', 0), ('1000.0-2500.0', 0),
+             ('2500.0-5000.0', 4), ('5000.0-*', 0)])
+
+    def test_deleted_after_ranking(self):
+        ranked = [(1.0, 'te01-0'), (0.5, 'te01-9')]
+        hits = postgis._hits('activiteit', ranked, None, False, False)
+        self.assertEqual([h['_id'] for h in hits], ['te01-0'])
+
+    def test_shape(self):
+        hit = self.search(q='koken', fields=['naam'])['hits'][0]
+        self.assertEqual(hit['_type'], 'activiteit')
+        self.assertEqual(hit['_source'], {'naam': 'Koken'})
+        self.assertEqual(hit['sort'][1], 'te01-2')
+
+
+class FallbackTest(TestCase):
+
+    @mock.patch('api.views.postgis.search', return_value='{"hits": {}}')
+    @mock.patch('api.views.elastic.search', side_effect=elastic.CircuitOpen)
+    def test_switches_when_circuit_open(self, search, fallback):
+        response = self.client.get('/zorg/zoek/', {'query': 'yoga'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'fallback')
+        self.assertEqual(fallback.call_args[1]['q'], 'yoga')
+
+    @override_settings(SEARCH_FALLBACK=False)
+    @mock.patch('api.views.elastic.search', side_effect=elastic.CircuitOpen)
+    def test_unavailable_without_fallback(self, search):
+        response = self.client.get('/zorg/zoek/', {'query': 'yoga'})
+        self.assertEqual(response.status_code, 503)
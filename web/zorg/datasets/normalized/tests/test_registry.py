@@ -0,0 +1,54 @@
+# Packages
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase
+
+# Project
+from api.views import search_params
+from datasets.normalized import models, registry
+
+
+class TagRegistryTest(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = registry.TagRegistry([
+            (1, 'maandag', 'DAG'), (2, 'dinsdag', 'DAG'), (3, 'Gratis', 'BETAALD')])
+
+    def test_names(self):
+        self.assertEqual(self.registry.names('DAG'), ['maandag', 'dinsdag'])
+        self.assertEqual(self.registry.names('TIJD'), [])
+        self.assertEqual(len(self.registry.names()), 3)
+
+    def test_resolve(self):
+        self.assertEqual(
+            self.registry.resolve(['maandag', ' gratis', 'onbekend']),
+            {'maandag': 1, ' gratis': 3})
+
+    def test_normalize(self):
+        self.assertEqual(
+            self.registry.normalize(['Maandag', 'gratis', 'maandag']),
+            ['Gratis', 'maandag'])
+        with self.assertRaises(ValueError):
+            self.registry.normalize(['maandag', 'onbekend'])
+
+
+class InvalidationTest(TestCase):
+
+    def setUp(self):
+        registry.invalidate()
+        models.TagDefinition.objects.create(naam='maandag', category='DAG')
+
+    def test_tags_endpoint(self):
+        self.assertEqual(self.client.get('/zorg/tags/DAG/').json(), ['maandag'])
+        with self.assertNumQueries(0):
+            self.client.get('/zorg/tags/DAG/')
+        models.TagDefinition.objects.create(naam='dinsdag', category='DAG')
+        # As on commit, which never comes in a TestCase
+        registry.invalidate()
+        self.assertEqual(
+            self.client.get('/zorg/tags/DAG/').json(), ['maandag', 'dinsdag'])
+
+    def test_search_tags(self):
+        params = search_params(QueryDict('tag=Maandag&tag=maandag'))
+        self.assertEqual(params['tags'], ['maandag'])
+        with self.assertRaises(ValueError):
+            search_params(QueryDict('tag=onbekend'))
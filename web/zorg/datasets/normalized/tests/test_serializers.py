@@ -0,0 +1,30 @@
+# Packages
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+# Project
+from datasets.normalized import models
+from datasets.normalized.serializers import guid_from_id
+
+
+class GuidFromIdTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='te01')
+        self.profile = models.Profile.objects.create(
+            auth_user=self.user, guid='te01', naam='te01', contact={})
+
+    def test_profile_looked_up_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(guid_from_id(self.user, '1'), 'te01-1')
+            self.assertEqual(guid_from_id(self.user, ''), 'te01')
+        # A new request gets a fresh user object, the process cache still has it
+        with self.assertNumQueries(0):
+            user = User(pk=self.user.pk)
+            self.assertEqual(guid_from_id(user, '2'), 'te01-2')
+
+    def test_invalidated_on_save(self):
+        guid_from_id(self.user, '1')
+        self.profile.guid = 'te02'
+        self.profile.save()
+        self.assertEqual(guid_from_id(User(pk=self.user.pk), '1'), 'te02-1')
@@ -0,0 +1,41 @@
+# Python
+from unittest import mock
+
+# Packages
+from django.test import TestCase, override_settings
+
+# Project
+from datasets.normalized import sync
+
+
+class FlushTest(TestCase):
+
+    @mock.patch('datasets.normalized.sync.bulk', side_effect=ConnectionError)
+    @mock.patch('datasets.normalized.sync.django_rq')
+    def test_restores_dirty_guids_on_failure(self, django_rq, bulk):
+        pipe = django_rq.get_connection.return_value.pipeline.return_value
+        pipe.execute.side_effect = [
+            ({b'te01-1'}, 1), (set(), 0), (set(), 0), None]
+        with self.assertRaises(ConnectionError):
+            sync.flush()
+        pipe.sadd.assert_called_once_with(
+            sync._DIRTY_KEY.format('activiteit'), 'te01-1')
+
+    @override_settings(ELASTIC_SYNC_RETRIES=2)
+    @mock.patch('datasets.normalized.sync.time.sleep')
+    @mock.patch('datasets.normalized.sync.bulk', side_effect=ConnectionError)
+    @mock.patch('datasets.normalized.sync.django_rq')
+    def test_retries_later(self, django_rq, bulk, sleep):
+        pipe = django_rq.get_connection.return_value.pipeline.return_value
+        pipe.execute.return_value = (set(), 0)
+        enqueue = django_rq.get_queue.return_value.enqueue
+        with self.assertRaises(ConnectionError):
+            sync.flush()
+        sleep.assert_not_called()
+        enqueue.assert_called_once_with(sync.flush, 1)
+
+        with self.assertRaises(ConnectionError):
+            sync.flush(2)
+        sleep.assert_called_once_with(20)
+        # Given up after the last retry
+        self.assertEqual(enqueue.call_count, 1)
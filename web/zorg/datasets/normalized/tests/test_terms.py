@@ -0,0 +1,52 @@
+# Packages
+from django.test import SimpleTestCase, TestCase, override_settings
+
+# Project
+from datasets.normalized import models, terms
+
+
+class TokensTest(SimpleTestCase):
+
+    def test_dutch_rules(self):
+        self.assertEqual(
+            terms.tokens('Yoga voor de Ouderen', 'in 2 groepen, 1x per week'),
+            {'yoga', 'ouderen', 'groepen', '1x', 'per', 'week'})
+
+
+class SpillCounterTest(SimpleTestCase):
+
+    def test_merges_spilled_runs(self):
+        counter = terms.SpillCounter(limit=2)
+        counter.update({'yoga', 'dans'})
+        counter.update({'yoga', 'zwemmen', 'koken'})
+        counter.update({'dans'})
+        self.assertTrue(counter.runs)
+        self.assertEqual(
+            list(counter.items()),
+            [('dans', 2), ('koken', 1), ('yoga', 2), ('zwemmen', 1)])
+
+
+@override_settings(ELASTIC_SYNC=False)
+class IncrementalTest(TestCase):
+
+    def setUp(self):
+        models.Locatie.objects.create(guid='te01-1', id='1', naam='Buurthuis')
+        models.Activiteit.objects.create(
+            guid='te01-1', id='1', naam='Hatha yoga', bron_link='http://localhost')
+        list(terms.generate())
+
+    def test_generate(self):
+        self.assertEqual(terms.vocabulary(), {
+            'buurthuis': 1, 'hatha': 1, 'yoga': 1, 'hatha yoga': 1})
+
+    def test_only_changed_terms(self):
+        models.Activiteit.objects.create(
+            guid='te01-2', id='2', naam='Yoga', bron_link='http://localhost')
+        models.Locatie.objects.filter(guid='te01-1').delete()
+        changes = {'activiteit': {'te01-2'}, 'locatie': {'te01-1'}}
+
+        actions = {a['_id']: a for a in terms.actions(changes, 'zorg')}
+        self.assertEqual(set(actions), {'yoga', 'buurthuis'})
+        self.assertEqual(actions['yoga']['_source']['gewicht'], 2)
+        self.assertEqual(actions['buurthuis']['_op_type'], 'delete')
+        self.assertEqual(terms.vocabulary()['yoga'], 2)
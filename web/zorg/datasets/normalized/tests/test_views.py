@@ -0,0 +1,142 @@
+# Python
+import gzip
+import json
+
+# Packages
+from django.test import TestCase
+
+# Project
+from datasets.normalized import models
+
+
+class ListQueryBudgetTest(TestCase):
+    """List pages are served in a constant number of queries."""
+
+    # COUNT + page, plus one query per prefetched relation
+    budgets = {
+        '/zorg/activiteit/': 4,
+        '/zorg/organisatie/': 2,
+        '/zorg/locatie/': 2,
+    }
+
+    def create_rows(self, start, count):
+        tags = [
+            models.TagDefinition.objects.get_or_create(naam=naam, category='DAG')[0]
+            for naam in ('maandag', 'dinsdag')]
+        for i in range(start, start + count):
+            locatie = models.Locatie.objects.create(
+                guid=f'te01-l{i}', id=f'l{i}', naam=f'locatie {i}')
+            organisatie = models.Organisatie.objects.create(
+                guid=f'te{i:02}', id=str(i), naam=f'organisatie {i}',
+                contact={}, locatie=locatie)
+            activiteit = models.Activiteit.objects.create(
+                guid=f'te01-a{i}', id=f'a{i}', naam=f'activiteit {i}',
+                bron_link='http://localhost', locatie=locatie,
+                organisatie=organisatie)
+            activiteit.tags.set(tags)
+            activiteit.persoon.add(models.Persoon.objects.create(
+                guid=f'te01-p{i}', naam=f'persoon {i}', contact={}))
+
+    def assert_budget(self, rows):
+        for url, budget in self.budgets.items():
+            with self.assertNumQueries(budget):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['results']), rows)
+
+    def test_list_budget(self):
+        self.create_rows(0, 1)
+        self.assert_budget(1)
+        self.create_rows(1, 24)
+        self.assert_budget(25)
+
+
+class CursorPaginationTest(TestCase):
+
+    def setUp(self):
+        for i in range(5):
+            models.Locatie.objects.create(guid=f'te01-{i}', id=str(i), naam=str(i))
+
+    def test_walk_collection(self):
+        url = '/zorg/locatie/?pagination=cursor&page_size=2'
+        guids = []
+        while url:
+            # No COUNT, just the page
+            with self.assertNumQueries(1):
+                response = self.client.get(url).json()
+            self.assertNotIn('count', response)
+            guids.extend(locatie['guid'] for locatie in response['results'])
+            url = response['next']
+        self.assertEqual(guids, [f'te01-{i}' for i in range(5)])
+
+    def test_optional_count(self):
+        response = self.client.get('/zorg/locatie/?pagination=cursor&count=true')
+        self.assertEqual(response.json()['count'], 5)
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        locatie = models.Locatie.objects.create(guid='te01-1', id='1', naam='locatie')
+        activiteit = models.Activiteit.objects.create(
+            guid='te01-1', id='1', naam='activiteit', bron_link='http://localhost',
+            locatie=locatie)
+        activiteit.tags.add(models.TagDefinition.objects.create(naam='maandag', category='DAG'))
+
+    def test_ndjson(self):
+        with self.assertNumQueries(3):  # batch, its tags, empty next batch
+            response = self.client.get('/zorg/export/activiteit.ndjson')
+            rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['locatie']['naam'], 'locatie')
+        self.assertIsNone(rows[0]['organisatie'])
+        self.assertEqual(rows[0]['tags'], ['maandag'])
+
+    def test_csv_gzip(self):
+        response = self.client.get('/zorg/export/activiteit.csv', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['guid', 'id', 'naam'])
+        self.assertTrue(lines[1].endswith(',maandag'))
+
+    def test_not_modified(self):
+        last_modified = self.client.get('/zorg/export/locatie.ndjson')['Last-Modified']
+        response = self.client.get(
+            '/zorg/export/locatie.ndjson', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        self.locatie = models.Locatie.objects.create(guid='te01-1', id='1', naam='locatie')
+
+    def test_list_not_modified(self):
+        response = self.client.get('/zorg/locatie/')
+        self.assertIn('public', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client.get('/zorg/locatie/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed(self):
+        etag = self.client.get('/zorg/locatie/')['ETag']
+        self.locatie.naam = 'buurthuis'
+        self.locatie.save()
+        response = self.client.get('/zorg/locatie/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_object_tags(self):
+        activiteit = models.Activiteit.objects.create(
+            guid='te01-1', id='1', naam='activiteit', bron_link='http://localhost')
+        etag = self.client.get('/zorg/activiteit/te01-1/')['ETag']
+        response = self.client.get('/zorg/activiteit/te01-1/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        activiteit.tags.add(models.TagDefinition.objects.create(naam='maandag', category='DAG'))
+        response = self.client.get('/zorg/activiteit/te01-1/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['tags'], ['maandag'])
+
+    def test_tags(self):
+        etag = self.client.get('/zorg/tags/DAG/')['ETag']
+        response = self.client.get('/zorg/tags/DAG/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
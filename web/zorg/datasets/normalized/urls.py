@@ -3,7 +3,9 @@ from django.conf.urls import include, url
 from rest_framework import routers
 
 # Project
-from .views import OrganisatieViewSet, ActiviteitViewSet, LocatieViewSet, TagsApiView
+from .export import export
+from .views import OrganisatieViewSet, ActiviteitViewSet, LocatieViewSet, TagsApiView, BatchUpdateView, \
+    BatchJobView
 
 nrouter = routers.SimpleRouter()
 nrouter.register(r'organisatie', OrganisatieViewSet, base_name='organisatie')
@@ -12,5 +14,8 @@ nrouter.register(r'locatie', LocatieViewSet, base_name='locatie')
 
 urlpatterns = [
     url(r'^zorg/tags/([\w-]+)/$', TagsApiView.as_view()),
+    url(r'^zorg/batch_update/?$', BatchUpdateView.as_view()),
+    url(r'^zorg/batch_job/(?P<jobid>\d+)/?$', BatchJobView.as_view()),
+    url(r'^zorg/export/(activiteit|locatie|organisatie)\.(ndjson|csv)$', export),
     url(r'^zorg/', include(nrouter.urls)),
 ]
@@ -0,0 +1,116 @@
+"""Modification stamps per collection.
+
+Signal handlers store the time of the latest write to each collection in the
+(shared) cache, so views can answer "did anything change since ..." without
+touching the tables themselves.
+"""
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import models
+
+_KEY = 'zorg:modified:{}'
+
+COLLECTIONS = {
+    models.Activiteit: 'activiteit',
+    models.Locatie: 'locatie',
+    models.Organisatie: 'organisatie',
+    models.TagDefinition: 'tags',
+}
+
+
+def touch(*collections):
+    """Mark `collections` as modified, once the current transaction commits.
+
+    Needed after writes that don't send signals, like bulk_create.
+    """
+    def _touch():
+        now = time.time()
+        cache.set_many(
+            {_KEY.format(name): now for name in collections}, timeout=None)
+    transaction.on_commit(_touch)
+
+
+def stamps(*collections):
+    """Times of the latest write to each of `collections`, or None when
+    that's unknown.
+
+    A collection without a stamp (new or flushed cache) counts as modified
+    now, so clients fetch it once more and the stamp is known from then on.
+    """
+    keys = [_KEY.format(name) for name in collections]
+    found = cache.get_many(keys)
+    for key in set(keys) - set(found):
+        now = time.time()
+        if cache.add(key, now, timeout=None):
+            found[key] = now
+    if len(found) < len(set(keys)):
+        return None
+    return [found[key] for key in keys]
+
+
+def last_modified(*collections):
+    """Time of the latest write to any of `collections`, or None when that's
+    unknown."""
+    times = stamps(*collections)
+    if not times:
+        return None
+    return datetime.fromtimestamp(max(times), tz=timezone.utc)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def _model_changed(sender, **kwargs):
+    name = COLLECTIONS.get(sender)
+    if name is not None:
+        touch(name)
+
+
+@receiver(m2m_changed, sender=models.Activiteit.tags.through)
+def _tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith('post_'):
+        touch('activiteit')
+        # Adding or removing tags doesn't save the activiteit
+        guids = (pk_set or ()) if reverse else [instance.pk]
+        models.Activiteit.objects.filter(guid__in=guids).update(
+            updated_at=datetime.now(timezone.utc))
+
+
+_GENERATION_KEY = 'zorg:index:generation'
+_TERMS_GENERATION_KEY = 'zorg:terms:generation'
+
+
+def _generation(key) -> int:
+    return cache.get(key) or 0
+
+
+def _bump(key):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add and incr
+        cache.set(key, 1, timeout=None)
+
+
+def index_generation() -> int:
+    """Counter that changes whenever the contents of the search index do."""
+    return _generation(_GENERATION_KEY)
+
+
+def bump_index_generation():
+    _bump(_GENERATION_KEY)
+
+
+def terms_generation() -> int:
+    """Counter that changes whenever the typeahead vocabulary does."""
+    return _generation(_TERMS_GENERATION_KEY)
+
+
+def bump_terms_generation():
+    _bump(_TERMS_GENERATION_KEY)
@@ -1,15 +1,77 @@
+# Python
+import hashlib
+
 # Packages
+from django.conf import settings
 from django.http import JsonResponse, HttpResponseNotFound
 from django.shortcuts import get_object_or_404
-from django.views.generic import ListView
-from rest_framework import viewsets
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.views.generic import View
+from rest_framework import generics, status, viewsets
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 # Project
-from .models import Organisatie, Activiteit, Locatie, TagDefinition
-from .serializers import OrganisatieSerializer, ActiviteitSerializer, LocatieSerializer, TagDefinitionSerializer
+from . import batch, registry, versions
+from .models import Organisatie, Activiteit, Locatie, TagDefinition, BatchJob
+from .serializers import OrganisatieSerializer, ActiviteitSerializer, LocatieSerializer, TagDefinitionSerializer, \
+    BatchJobSerializer
+
 
+class ConditionalMixin:
+    """
+    Answers conditional GETs from the version stamps of `collections`, before
+    the view runs a query or a serializer, and lets browsers and the CDN keep
+    responses for a while. A single object is versioned by its updated_at
+    instead of by its own collection, the first of `collections`.
+    """
+    collections = ()
+
+    def stamps(self, kwargs):
+        """Stamps the response depends on, None when they're unknown."""
+        lookup = getattr(self, 'lookup_field', None)
+        if lookup not in kwargs:
+            return versions.stamps(*self.collections)
+        model = self.serializer_class.Meta.model
+        updated_at = model.objects.filter(**{lookup: kwargs[lookup]}).values_list(
+            'updated_at', flat=True).first()
+        related = versions.stamps(*self.collections[1:])
+        if updated_at is None or related is None:
+            return None
+        return [updated_at.timestamp()] + related
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        stamps = self.stamps(kwargs)
+        etag = last_modified = None
+        if stamps:
+            # Browsable API and JSON are different representations
+            variant = (stamps, request.META.get('HTTP_ACCEPT', ''))
+            etag = quote_etag(hashlib.md5(repr(variant).encode()).hexdigest())
+            last_modified = int(max(stamps))
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            if etag:
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(
+                response, public=True, max_age=settings.HTTP_CACHE_MAX_AGE,
+                s_maxage=settings.HTTP_CACHE_S_MAXAGE)
+            patch_vary_headers(response, ('Accept',))
+        return response
+
+
+class ZorgViewSet(ConditionalMixin, viewsets.ModelViewSet):
+    # Actions that render existing objects, their querysets load the relations
+    # the serializer needs up front instead of one query per row
+    read_actions = ('list', 'retrieve')
 
-class ZorgViewSet(viewsets.ModelViewSet):
     def get_object(self):
         queryset = self.get_queryset()
         filter = {
@@ -20,44 +82,77 @@ class ZorgViewSet(viewsets.ModelViewSet):
 
 class OrganisatieViewSet(ZorgViewSet):
     serializer_class = OrganisatieSerializer
+    collections = ('organisatie',)
 
     def get_queryset(self):
-        return Organisatie.objects.all()
+        # locatie_id is rendered from the foreign key column, no join needed
+        return Organisatie.objects.order_by('guid')
 
 
 class ActiviteitViewSet(ZorgViewSet):
     serializer_class = ActiviteitSerializer
+    collections = ('activiteit', 'tags')
 
     def get_queryset(self):
-        return Activiteit.objects.all()
+        queryset = Activiteit.objects.order_by('guid')
+        if self.action in self.read_actions:
+            queryset = queryset.prefetch_related('tags', 'persoon')
+        return queryset
 
 
 class LocatieViewSet(ZorgViewSet):
     serializer_class = LocatieSerializer
+    collections = ('locatie',)
 
     def get_queryset(self):
-        return Locatie.objects.all()
+        return Locatie.objects.order_by('guid')
 
 
-class TagDefinitionViewSet(viewsets.ModelViewSet):
+class TagDefinitionViewSet(ConditionalMixin, viewsets.ModelViewSet):
     serializer_class = TagDefinitionSerializer
+    collections = ('tags',)
 
     def get_queryset(self):
         return TagDefinition.objects.filter(category='BETAALD')
 
 
-class TagsApiView(ListView):
+class TagsApiView(ConditionalMixin, View):
     """
     Read only api endpoint for tags
     Works for listing all tags and for specific tag name
+    Served from the tag registry of the process
+    """
+    collections = ('tags',)
+
+    def get(self, request, *args):
+        category = args[0] if args else None
+        return JsonResponse(registry.tags().names(category), status=200, safe=False)
+
+
+class BatchUpdateView(APIView):
+    """
+    Accepts a list of insert/patch/delete operaties and queues them for
+    processing. Answers with the job to poll at /zorg/batch_job/{jobid}.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        records = request.data
+        if not isinstance(records, list) or not records:
+            return Response(
+                {'detail': 'Expected a non-empty list of operaties'},
+                status=status.HTTP_400_BAD_REQUEST)
+        job = batch.enqueue(request.user, records)
+        return Response(BatchJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class BatchJobView(generics.RetrieveAPIView):
+    """
+    Progress, per record errors and throughput of your own batch jobs
     """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = BatchJobSerializer
+    lookup_url_kwarg = 'jobid'
 
     def get_queryset(self):
-        try:
-            return TagDefinition.objects.filter(category=self.args[0])
-        except IndexError:
-            return TagDefinition.objects.all()
-
-    def render_to_response(self, context, **response_kwargs):
-        resp = TagDefinitionSerializer(list(context['object_list']), many=True)
-        return JsonResponse(resp.data, status=200, safe=False)
+        return BatchJob.objects.filter(auth_user=self.request.user)
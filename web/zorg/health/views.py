@@ -3,11 +3,10 @@ import logging
 
 from django.conf import settings
 from django.db import connection
-from django.http import HttpResponse
-from elasticsearch import Elasticsearch
-from elasticsearch_dsl import Search
+from django.http import HttpResponse, JsonResponse
+from api.cache import search_cache, typeahead_cache
+from datasets.normalized import elastic
 from datasets.normalized.models import Activiteit, Organisatie, Locatie
-from zorg import  settings as zorg_settings
 
 
 log = logging.getLogger(__name__)
@@ -27,8 +26,8 @@ def health(request):
 
     # check elasticsearch
     try:
-        client = Elasticsearch(zorg_settings.ELASTIC_SEARCH_HOSTS)
-        assert client.info()
+        assert elastic._elasticsearch().info(
+            request_timeout=settings.ELASTIC_HEALTH_TIMEOUT)
     except:
         log.exception("Elasticsearch connectivity failed")
         return HttpResponse(
@@ -63,9 +62,9 @@ def check_data(request):
 
     # check elastic
     try:
-        print(zorg_settings.ELASTIC_SEARCH_HOSTS)
-        client = Elasticsearch(zorg_settings.ELASTIC_SEARCH_HOSTS)
-        v = client.search(index = 'zorg',body='', size=0)
+        elastic._elasticsearch().search(
+            index=settings.ELASTIC_INDEX, size=0,
+            request_timeout=settings.ELASTIC_HEALTH_TIMEOUT)
     except Exception as e:
         log.error(e)
         message = "Error connecting to elastic"
@@ -77,3 +76,13 @@ def check_data(request):
         status = 500
 
     return HttpResponse(message, content_type='text/plain', status=status)
+
+
+def cache_stats(request):
+    # hit ratios of the search response caches, geo searches separately
+    return JsonResponse({
+        'geo_grid': settings.SEARCH_GEO_GRID,
+        'circuit_open': elastic.breaker.is_open,
+        'search': search_cache.hit_ratios(labels=('geo',)),
+        'typeahead': typeahead_cache.hit_ratios(),
+    })
@@ -0,0 +1,41 @@
+"""
+ASGI config for zorg project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Search and typeahead requests are handled by :mod:`api.async_views`, so one
+process can have many of them in flight; all other requests are passed on to
+the WSGI application, in a thread.
+
+Run with e.g. ``uvicorn zorg.asgi:application --workers 4``.
+"""
+
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "zorg.settings")
+
+_wsgi = WsgiToAsgi(get_wsgi_application())
+
+# Needs the settings, so it's imported after Django's setup
+from api import async_views, typeahead  # noqa: E402
+
+typeahead.warm()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_views.client.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] == 'http':
+        found = async_views.route(scope['path'])
+        if found is not None:
+            return await async_views.handle(scope, receive, send, *found)
+    return await _wsgi(scope, receive, send)
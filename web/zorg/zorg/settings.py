@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     # Packages
+    'django_rq',
     'rest_framework',
     'rest_framework.authtoken',
     # Project
@@ -120,32 +121,67 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'datasets.normalized.pagination.ZorgPagination',
     'PAGE_SIZE': 100,
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
 }
 
+# Default pagination of the collections, 'page' or 'cursor'. Clients can pick
+# one with ?pagination=
+ZORG_PAGINATION = os.getenv('ZORG_PAGINATION', 'page')
+
+# Seconds a process may use a cached Profile.guid
+PROFILE_GUID_CACHE_TTL = 300
+
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:6379/1',
+        'OPTIONS': {
+            # A cache outage shouldn't take the API down
+            'IGNORE_EXCEPTIONS': True,
+        },
+    },
+}
+# Runs the tests with a local memory cache
+TEST_RUNNER = 'zorg.test_runner.TestRunner'
+
 RQ_QUEUES = {
     'default': {
-        'HOST': 'localhost',
+        'HOST': REDIS_HOST,
         'PORT': 6379,
         'DB': 0,
         'DEFAULT_TIMEOUT': 240,
     },
     'high': {
-        'HOST': 'localhost',
+        'HOST': REDIS_HOST,
         'PORT': 6379,
         'DB': 0,
         'DEFAULT_TIMEOUT': 240,
     },
     'low': {
-        'HOST': 'localhost',
+        'HOST': REDIS_HOST,
         'PORT': 6379,
         'DB': 0,
         'DEFAULT_TIMEOUT': 240,
     }
 }
 
+# Cache-Control of the public GET endpoints of the collections and tags:
+# seconds browsers and the CDN may keep a response without revalidating
+HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', 60))
+HTTP_CACHE_S_MAXAGE = int(os.getenv('HTTP_CACHE_S_MAXAGE', 300))
+
+# Rows per query of the /zorg/export/ streams
+EXPORT_BATCH_SIZE = 2000
+
+# /zorg/batch_update: records per transaction, and the largest batch that
+# still goes to the `high` queue
+BATCH_CHUNK_SIZE = 500
+BATCH_HIGH_PRIORITY_MAX = 100
+
 # RQ_EXCEPTION_HANDLERS = ['path.to.my.handler'] # If you need custom exception handlers
 
 
@@ -173,7 +209,77 @@ ELASTIC_SEARCH_HOSTS = ["{}:{}".format(
     os.getenv('ELASTICSEARCH_PORT_9200_TCP_ADDR', _get_docker_host()),
     os.getenv('ELASTICSEARCH_PORT_9200_TCP_PORT', '9200'))]
 
+# Keep-alive connections per Elastic node and process, and whether to discover
+# the other nodes of the cluster when there's more than one host
+ELASTIC_MAXSIZE = int(os.getenv('ELASTIC_MAXSIZE', 25))
+ELASTIC_SNIFF = os.getenv('ELASTIC_SNIFF', 'true').lower() == 'true'
+# Seconds to wait for Elastic: by default, for searches and for health probes
+ELASTIC_TIMEOUT = float(os.getenv('ELASTIC_TIMEOUT', 30))
+ELASTIC_SEARCH_TIMEOUT = float(os.getenv('ELASTIC_SEARCH_TIMEOUT', 5))
+ELASTIC_HEALTH_TIMEOUT = float(os.getenv('ELASTIC_HEALTH_TIMEOUT', 2))
+# Searches fail fast for ELASTIC_CIRCUIT_RESET seconds after this many
+# timeouts or overload errors in a row
+ELASTIC_CIRCUIT_FAILURES = int(os.getenv('ELASTIC_CIRCUIT_FAILURES', 5))
+ELASTIC_CIRCUIT_RESET = float(os.getenv('ELASTIC_CIRCUIT_RESET', 30))
+# Search the database instead while the circuit is open, counting no more
+# than SEARCH_FALLBACK_MAX_TOTAL matches and looking at no more than
+# SEARCH_FALLBACK_MAX_CANDIDATES nearest locaties per geo search
+SEARCH_FALLBACK = os.getenv('SEARCH_FALLBACK', 'true').lower() == 'true'
+SEARCH_FALLBACK_MAX_TOTAL = int(os.getenv('SEARCH_FALLBACK_MAX_TOTAL', 10000))
+SEARCH_FALLBACK_MAX_CANDIDATES = int(
+    os.getenv('SEARCH_FALLBACK_MAX_CANDIDATES', 10000))
+
+# Alias, the physical indices are named <ELASTIC_INDEX>_<timestamp>
 ELASTIC_INDEX = 'zorg'
+# Number of previous index versions kept around for rollback
+ELASTIC_INDEX_RETENTION = int(os.getenv('ELASTIC_INDEX_RETENTION', 2))
+ELASTIC_INDEX_REPLICAS = int(os.getenv('ELASTIC_INDEX_REPLICAS', 1))
+ELASTIC_INDEX_REFRESH_INTERVAL = os.getenv('ELASTIC_INDEX_REFRESH_INTERVAL', '1s')
+
+# Parts of the Elastic response /zorg/zoek/ passes on, and the _source fields
+# of the hits (None for all)
+ELASTIC_SEARCH_FILTER_PATH = [
+    'took', 'hits.total', 'hits.max_score', 'hits.hits._id', 'hits.hits._type',
+    'hits.hits._score', 'hits.hits._source', 'hits.hits.sort',
+]
+ELASTIC_SEARCH_SOURCE = None
+# Hits per /zorg/zoek/ page, by default and at most
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 100
+# Elastic connections of the ASGI search endpoints per process, requests in
+# flight at most, and seconds to wait for a slot or for Elastic
+ELASTIC_ASYNC_POOL_SIZE = int(os.getenv('ELASTIC_ASYNC_POOL_SIZE', 100))
+ELASTIC_ASYNC_MAX_CONCURRENCY = int(os.getenv('ELASTIC_ASYNC_MAX_CONCURRENCY', 200))
+ELASTIC_ASYNC_TIMEOUT = float(os.getenv('ELASTIC_ASYNC_TIMEOUT', 10))
+
+# Push model changes to the index from the `low` RQ queue
+ELASTIC_SYNC = os.getenv('ELASTIC_SYNC', 'true').lower() == 'true'
+# Seconds after which a lost flush job no longer blocks scheduling a new one
+ELASTIC_SYNC_SCHEDULE_TTL = 300
+# A failed flush is retried this many times, after 10, 20, 40... seconds
+ELASTIC_SYNC_RETRIES = int(os.getenv('ELASTIC_SYNC_RETRIES', 5))
+ELASTIC_SYNC_RETRY_DELAY = 10
+ELASTIC_BULK_CHUNK_SIZE = int(os.getenv('ELASTIC_BULK_CHUNK_SIZE', 500))
+ELASTIC_BULK_THREADS = int(os.getenv('ELASTIC_BULK_THREADS', 4))
+
+# Cached /zorg/zoek/ and /zorg/typeahead/ responses: entries per process in
+# the in-memory tier, seconds to live, and how often a process checks for a
+# new index generation
+SEARCH_CACHE_LOCAL_SIZE = 1024
+SEARCH_CACHE_TTL = 300
+TYPEAHEAD_CACHE_TTL = 3600
+# 'elastic' (completion suggester) or 'memory' (a prefix index per process)
+TYPEAHEAD_ENGINE = os.getenv('TYPEAHEAD_ENGINE', 'elastic')
+# Minimum seconds between rebuilds of the 'memory' typeahead index
+TYPEAHEAD_REBUILD_INTERVAL = int(os.getenv('TYPEAHEAD_REBUILD_INTERVAL', 60))
+# Distinct typeahead terms counted in memory before spilling to disk
+TERMS_MEMORY_LIMIT = int(os.getenv('TERMS_MEMORY_LIMIT', 500000))
+SEARCH_CACHE_GENERATION_CHECK = 1.0
+# Seconds between adding the per process hit counts to the shared ones
+SEARCH_CACHE_STATS_FLUSH = 10
+# Snap the lon/lat of searches to a grid of this many meters, so nearby users
+# share cached responses. The origin moves at most 0.71 * grid meters.
+SEARCH_GEO_GRID = float(os.getenv('SEARCH_GEO_GRID', 0)) or None
 
 LOGSTASH_HOST = os.getenv('LOGSTASH_HOST', '127.0.0.1')
 LOGSTASH_PORT = int(os.getenv('LOGSTASH_GELF_UDP_PORT', 12201))
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "zorg.settings")
 
 application = get_wsgi_application()
+
+# Build in-process indices before the first request comes in
+from api import typeahead  # noqa: E402
+typeahead.warm()